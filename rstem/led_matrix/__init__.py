@@ -20,16 +20,33 @@ This module provides interfaces to the LED Matrix RaspberrySTEM Cell.
 
 
 import os
-import re
 import time
+import json
+import mmap
+import struct
+import hashlib
+import weakref
 from . import led_driver     # c extension that controls led matrices and contains framebuffer
 import copy
 import subprocess
-from itertools import islice
-
-MAX_MATRICES = 64
+from itertools import islice, count
+from threading import Thread, Condition, Event
+from array import array
+from collections import deque, namedtuple, OrderedDict
+
+MAX_MATRICES = led_driver.MAX_MATRICES
+DETECT_MATRICES = 64
+TUNE_PATTERN_MATRICES = 4
+TUNE_RESOLUTION = 0.05
 MATRIX_SPI_SHIFT_REGISTER_LENGTH=32
 SPI_SPEED=250000
+SPI_MAX_SPEED=32000000
+SPI_SPEEDS_FILE=os.path.expanduser('~/.rstem_spi_speeds')
+SPRITE_CACHE_DIR=os.path.expanduser('~/.rstem_sprites')
+SPRITE_CACHE_FILES=1000
+FRAME_HISTORY = 1000
+SPRITE_CACHE_SIZE = 256
+DITHER_REFRESH_HZ = 200
 width = 0    #: The width of the LED matrix grid
 height = 0   #: The height of the LED matrix grid
 
@@ -48,20 +65,274 @@ def _to_color(color):
         raise ValueError("Invalid Color: must be a string between 0-9 or a-f or '-'")
     return int(color, 16) if color != '-' else -1
 
+# Color strings, by color: -1 (transparent) is '-', and 0-255 (any byte of a
+# framebuffer) are hex.
+_COLOR_STRS = dict([(-1, '-')] + [(color, '{:X}'.format(color)) for color in range(256)])
+
+def _color_str(color):
+    return '{:X}'.format(color) if color >= 0 else '-'
+
 def _color_array_to_str(array, height, width):
-    s = ''
-    for y in reversed(range(height)):
-        for x in range(width):
-            color = array[x][y]
-            s += '{:1X}'.format(color) if color >= 0 else '-'
-        s += '\n'
-    return s
+    if not width:
+        return '\n' * height
+    rows = list(zip(*array[:width]))[:height]
+    try:
+        chars = _COLOR_STRS
+        return ''.join(''.join([chars[color] for color in row]) + '\n' for row in reversed(rows))
+    except KeyError:
+        return ''.join(''.join([_color_str(color) for color in row]) + '\n' for row in reversed(rows))
 
 def _quarter_clockwise_rotations(angle):
     if angle % 90 != 0:
         raise ValueError('angle must be a multiple of 90.')
     return int(angle/90) % 4
 
+def _saved_spi_speeds():
+    try:
+        with open(SPI_SPEEDS_FILE) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def _spi_speed(spi_port):
+    '''Returns the SPI speed for the given port: the speed found by
+    `FrameBuffer.tune_spi_speed()` if it has been run, otherwise `SPI_SPEED`.
+    '''
+    return _saved_spi_speeds().get(str(spi_port), SPI_SPEED)
+
+_INVERT = bytes(255 - i for i in range(256))
+_NONZERO = bytes([0]) + bytes([0xFF]) * 255
+_NOT_TRANSPARENT = bytes([0xFF]) * 255 + bytes([0])
+_TRANSPARENT = bytes(255) + bytes([0xFF])
+_IDENTITY_LUT = bytes(range(16))
+
+def _blend(fb, offset, pixels, mask):
+    '''Copies `pixels` into `fb` at `offset`, where `mask` is 0xFF.
+
+    Transparent pixels must be 0.  The copy is done all at once, with the
+    pixels as big integers.
+    '''
+    length = len(pixels)
+    keep = int.from_bytes(mask.translate(_INVERT), 'big')
+    current = int.from_bytes(fb[offset:offset + length], 'big')
+    fb[offset:offset + length] = \
+        ((current & keep) | int.from_bytes(pixels, 'big')).to_bytes(length, 'big')
+
+def _array_bytes(array):
+    '''Returns (width, height, bytes) of a 2-dimensional array indexed [x, y],
+    with the bytes in column-major order.
+    '''
+    try:
+        view = memoryview(array)
+    except TypeError:
+        columns = [bytes(color & 0xFF for color in column) for column in array]
+        height = len(columns[0]) if columns else 0
+        if any(len(column) != height for column in columns):
+            raise ValueError('All columns of the array must be the same height')
+        return len(columns), height, b''.join(columns)
+    if view.ndim != 2 or view.itemsize != 1:
+        raise ValueError('Array must be 2-dimensional, with 1 byte elements (for '
+            'example, a numpy.uint8 array)')
+    width, height = view.shape
+    return width, height, view.tobytes()
+
+def _array_pixels(array, mask=None):
+    '''Returns (width, height, pixels, mask) of an array of colors (see
+    `FrameBuffer.blit_array()`), with pixels and mask as in `_compile_bitmap()`.
+    '''
+    width, height, pixels = _array_bytes(array)
+    opaque_mask = pixels.translate(_NOT_TRANSPARENT)
+    if mask is not None:
+        mask_width, mask_height, mask = _array_bytes(mask)
+        if (mask_width, mask_height) != (width, height):
+            raise ValueError('Mask must be the same shape as the array')
+        opaque_mask = bytes(a & b for a, b in zip(opaque_mask, mask.translate(_NONZERO)))
+    if 0 in opaque_mask:
+        pixels = bytes(a & b for a, b in zip(pixels, opaque_mask))
+    return width, height, pixels, opaque_mask
+
+_CompiledBitmap = namedtuple('_CompiledBitmap', 'width height pixels mask runs opaque')
+
+def _compile_bitmap(bitmap):
+    '''Compiles a bitmap (a list of columns of colors, -1 for transparent) for drawing.
+
+    The compiled bitmap has:
+        pixels      All pixels, one byte each, column-major (transparent pixels
+                    are 0)
+        mask        The transparency mask, in the same layout as pixels: 0xFF
+                    for opaque pixels, 0 for transparent pixels
+        runs        For each column, a list of (start, end) y ranges of
+                    consecutive opaque pixels
+        opaque      True if there are no transparent pixels
+    '''
+    width = len(bitmap)
+    height = len(bitmap[0]) if bitmap else 0
+    pixels = bytearray()
+    mask = bytearray()
+    runs = []
+    for column in bitmap:
+        if -1 not in column:
+            pixels += bytes(column)
+            mask += b'\xff' * height
+            runs.append([(0, height)])
+            continue
+        column_runs = []
+        start = None
+        for y, color in enumerate(column):
+            if color >= 0:
+                if start is None:
+                    start = y
+            elif start is not None:
+                column_runs.append((start, y))
+                start = None
+        if start is not None:
+            column_runs.append((start, height))
+        pixels += bytes(max(color, 0) for color in column)
+        mask += bytes(0xFF if color >= 0 else 0 for color in column)
+        runs.append(column_runs)
+    opaque = all(mask)
+    return _CompiledBitmap(width, height, bytes(pixels), bytes(mask), runs, opaque)
+
+# A compiled sprite file, in SPRITE_CACHE_DIR, is the header below (with the
+# modification time and size of the sprite file it was compiled from) followed
+# by the sprite's bitmap: its columns, bottom to top, one byte per pixel (0xFF
+# for transparent).
+_SPRITE_CACHE_MAGIC = b'RSSP'
+_SPRITE_CACHE_VERSION = 1
+_SPRITE_CACHE_HEADER = struct.Struct('<4sHqqHH')
+
+def _load_sprite_file(filename):
+    '''Returns the bitmap of a sprite file, from the sprite cache if it has
+    been compiled since it was last modified.
+    '''
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    cache_path = os.path.join(SPRITE_CACHE_DIR,
+        hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest())
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        magic, version, mtime, size, width, height = _SPRITE_CACHE_HEADER.unpack_from(data)
+        pixels = data[_SPRITE_CACHE_HEADER.size:]
+        if ((magic, version, mtime, size) == (_SPRITE_CACHE_MAGIC, _SPRITE_CACHE_VERSION,
+                stat.st_mtime_ns, stat.st_size) and len(pixels) == width * height):
+            return [[-1 if pixel == 0xFF else pixel for pixel in pixels[x*height:(x + 1)*height]]
+                for x in range(width)]
+    except (IOError, OSError, struct.error):
+        pass
+
+    with open(path) as f:
+        bitmap = Sprite(f.read()).bitmap
+
+    # Caching is best effort: loading must not fail because the cache can't be
+    # written.
+    width, height = len(bitmap), len(bitmap[0]) if bitmap else 0
+    header = _SPRITE_CACHE_HEADER.pack(_SPRITE_CACHE_MAGIC, _SPRITE_CACHE_VERSION,
+        stat.st_mtime_ns, stat.st_size, width, height)
+    pixels = bytes(color & 0xFF for column in bitmap for color in column)
+    temp_path = '{}.{}'.format(cache_path, os.getpid())
+    try:
+        os.makedirs(SPRITE_CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            f.write(header + pixels)
+        os.replace(temp_path, cache_path)
+        _prune_sprite_cache()
+    except (IOError, OSError):
+        pass
+    return bitmap
+
+def _prune_sprite_cache():
+    '''Deletes the oldest compiled sprite files beyond the newest
+    SPRITE_CACHE_FILES, so entries for deleted or temporary sprite files don't
+    pile up.
+    '''
+    names = os.listdir(SPRITE_CACHE_DIR)
+    if len(names) <= SPRITE_CACHE_FILES:
+        return
+    entries = []
+    for name in names:
+        path = os.path.join(SPRITE_CACHE_DIR, name)
+        try:
+            entries.append((os.stat(path).st_mtime_ns, path))
+        except OSError:
+            pass
+    entries.sort(reverse=True)
+    for mtime, path in entries[SPRITE_CACHE_FILES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# A transform maps each pixel (u, v) of a transformed bitmap back to the pixel
+# (x, y) of the bitmap it was transformed from:
+#
+#     x = x0 + xu*u + xv*v
+#     y = y0 + yu*u + yv*v
+#
+# Transforms are stored as the tuple (x0, xu, xv, y0, yu, yv, width, height),
+# where width/height are the dimensions of the transformed bitmap.  Any
+# sequence of rotations, flips and crops composes into a single transform.
+def _identity_transform(width, height):
+    return (0, 1, 0, 0, 0, 1, width, height)
+
+def _compose_transforms(first, then):
+    '''Returns the transform equivalent to applying `first` and then `then`.
+    '''
+    x0, xu, xv, y0, yu, yv = first[:6]
+    a0, au, av, b0, bu, bv, width, height = then
+    return (x0 + xu*a0 + xv*b0, xu*au + xv*bu, xu*av + xv*bv,
+        y0 + yu*a0 + yv*b0, yu*au + yv*bu, yu*av + yv*bv, width, height)
+
+def _crop_transform(origin, dimensions, width, height):
+    x, y = origin
+    if x >= width:
+        raise IndexError('Origin X is greater than Sprite width')
+    if y >= height:
+        raise IndexError('Origin Y is greater than Sprite height')
+    if x < 0 or y < 0:
+        raise IndexError('Origin must not be negative')
+
+    try:
+        crop_width, crop_height = dimensions
+    except TypeError:
+        crop_width, crop_height = width, height
+
+    crop_width = max(0, min(x + crop_width, width) - x)
+    crop_height = max(0, min(y + crop_height, height) - y)
+    return (x, 1, 0, y, 0, 1, crop_width, crop_height)
+
+def _rotate_transform(angle, width, height):
+    quarter_clockwise_rotations = _quarter_clockwise_rotations(angle)
+    w, h = width, height
+    if quarter_clockwise_rotations == 0:
+        return _identity_transform(w, h)
+    elif quarter_clockwise_rotations == 1:
+        return (0, 0, 1, h - 1, -1, 0, h, w)
+    elif quarter_clockwise_rotations == 2:
+        return (w - 1, -1, 0, h - 1, 0, -1, w, h)
+    elif quarter_clockwise_rotations == 3:
+        return (w - 1, 0, -1, 0, 1, 0, h, w)
+    else:
+        raise RuntimeException('Internal Error: Invalid rotation')
+
+def _flip_transform(vertical, width, height):
+    if vertical:
+        return (0, 1, 0, height - 1, 0, -1, width, height)
+    else:
+        return (width - 1, -1, 0, 0, 0, 1, width, height)
+
+def _apply_transform(bitmap, transform):
+    x0, xu, xv, y0, yu, yv, width, height = transform
+    heights = range(height)
+    return [[bitmap[x0 + xu*u + xv*v][y0 + yu*u + yv*v] for v in heights]
+        for u in range(width)]
+
+# Process-wide LRU cache of transformed bitmaps, keyed by (base bitmap serial
+# number, transform).  Each value is a [bitmap, compiled bitmap] list, where the
+# compiled bitmap is filled in when first drawn.
+_transform_cache = OrderedDict()
+_bitmap_serials = count()
+
 class Sprite(object):
     '''A Sprite (2-dimensional bitmapped image) object.
 
@@ -93,67 +364,123 @@ class Sprite(object):
             f 0 0
         '''
         # Remove whitespace from lines
-        lines = (re.sub('\s', '', line) for line in image_string.splitlines())
+        lines = (''.join(line.split()) for line in image_string.splitlines())
         # remove blank lines
         lines = (line for line in lines if line)
         # Convert chars to integer colors
         reversed_transposed_bitmap = [[_to_color(color) for color in line] for line in lines]
         # Reverse and transpose array
         transposed_bitmap = list(reversed(reversed_transposed_bitmap))
-        self.original_bitmap = [list(z) for z in zip(*transposed_bitmap)]
-        self.bitmap = self.original_bitmap
+        self._set_original([list(z) for z in zip(*transposed_bitmap)])
+
+    def _set_original(self, bitmap):
+        self.original_bitmap = bitmap
+        self._original_serial = next(_bitmap_serials)
+        self._rebase(bitmap, self._original_serial)
+
+    def _rebase(self, bitmap, serial):
+        # Transforms are applied to the base bitmap, identified in the
+        # transform cache by its serial number.
+        self._base, self._base_serial = bitmap, serial
+        self._transform = _identity_transform(len(bitmap), len(bitmap[0]) if bitmap else 0)
+        self._entry = [bitmap, None]
 
     @classmethod
     def from_file(cls, filename):
-        with open(filename) as f:
-            s = cls(f.read())
+        '''Creates a `Sprite` object from a sprite file (a file containing an
+        `image_string`, see `__init__()`).
+
+        Parsed sprite files are cached in `SPRITE_CACHE_DIR`, so loading a
+        sprite file again (until it is modified) takes a single read.  The
+        cache keeps the `SPRITE_CACHE_FILES` most recently compiled sprite
+        files, deleting older ones as new sprite files are compiled.
+        '''
+        s = cls.__new__(cls)
+        s._set_original(_load_sprite_file(filename))
         return s
         
+    @classmethod
+    def from_array(cls, array, mask=None):
+        '''Creates a `Sprite` object from a 2-dimensional array of colors,
+        indexed [x, y], with transparency given by -1 (0xFF) colors or by
+        `mask` (see `FrameBuffer.blit_array()`).
+        '''
+        width, height, pixels, opaque_mask = _array_pixels(array, mask)
+        s = cls.__new__(cls)
+        s._set_original([[color if opaque else -1
+            for color, opaque in zip(pixels[x*height:(x + 1)*height], opaque_mask[x*height:(x + 1)*height])]
+            for x in range(width)])
+        return s
+
     def _bitmap(self):
         return self.bitmap
 
+    @property
+    def bitmap(self):
+        return self._entry[0]
+
+    @bitmap.setter
+    def bitmap(self, bitmap):
+        self._rebase(bitmap, next(_bitmap_serials))
+
+    def _compiled(self):
+        '''Returns the bitmap compiled for drawing (see `_compile_bitmap()`).
+
+        The compiled bitmap is cached along with the bitmap.
+        '''
+        if self._entry[1] is None:
+            self._entry[1] = _compile_bitmap(self._entry[0])
+        return self._entry[1]
+
     @property
     def width(self):
         '''Returns the width of the sprite.
         '''
-        return len(self.bitmap)
+        return self._transform[6]
 
     @property
     def height(self):
         '''Returns the height of the sprite.
         '''
-        return len(self.bitmap[0])
+        return self._transform[7]
 
     def __add__(self, sprite):
         if self.height != sprite.height:
             raise ValueError("Can only add sprites of the same height")
-        self.bitmap += sprite.bitmap
+        bitmap = self.bitmap + sprite.bitmap
+        if self.bitmap is self.original_bitmap:
+            self._set_original(bitmap)
+        else:
+            self.bitmap = bitmap
         return self
 
-    def _recreate_bitmap(self, xrange, yrange):
-        yrange = list(yrange)
-        self.bitmap = [[self.bitmap[x][y] for y in yrange] for x in xrange]
+    def _apply(self, transform):
+        '''Applies `transform` to the current bitmap.
+
+        Transformed bitmaps are cached (in a cache of up to
+        `SPRITE_CACHE_SIZE` bitmaps shared by all sprites), so repeating the
+        same transforms costs only a lookup.
+        '''
+        transform = _compose_transforms(self._transform, transform)
+        key = (self._base_serial, transform)
+        entry = _transform_cache.get(key)
+        if entry is None:
+            entry = [_apply_transform(self._base, transform), None]
+            _transform_cache[key] = entry
+            if len(_transform_cache) > SPRITE_CACHE_SIZE:
+                _transform_cache.popitem(last=False)
+        else:
+            _transform_cache.move_to_end(key)
+        self._transform = transform
+        self._entry = entry
+        return self
 
     def crop(self, origin=(0,0), dimensions=None):
         '''In-place crop of the sprite.
 
         Returns itself, so this function can be chained.
         '''
-        x, y = origin
-        if x >= self.width:
-            raise IndexError('Origin X is greater than Sprite width')
-        if y >= self.height:
-            raise IndexError('Origin Y is greater than Sprite height')
-
-        try:
-            width, height = dimensions
-        except TypeError:
-            width, height = self.width, self.height
-
-        xrange = range(x, min(x + width, self.width))
-        yrange = range(y, min(y + height, self.height))
-        self._recreate_bitmap(xrange, yrange)
-        return self
+        return self._apply(_crop_transform(origin, dimensions, self.width, self.height))
 
     def rotate(self, angle=90):
         '''In-place rotation of the sprite.
@@ -162,37 +489,24 @@ class Sprite(object):
 
         Returns itself, so this function can be chained.
         '''
-        quarter_clockwise_rotations = _quarter_clockwise_rotations(angle)
-        if quarter_clockwise_rotations == 0:
-            xrange, yrange = range(self.width), range(self.height)
-            transposed = False
-        elif quarter_clockwise_rotations == 1:
-            xrange, yrange = range(self.width), reversed(range(self.height))
-            transposed = True
-        elif quarter_clockwise_rotations == 2:
-            xrange, yrange = reversed(range(self.width)), reversed(range(self.height))
-            transposed = False
-        elif quarter_clockwise_rotations == 3:
-            xrange, yrange = reversed(range(self.width)), range(self.height)
-            transposed = True
-        else:
-            raise RuntimeException('Internal Error: Invalid rotation')
-        self._recreate_bitmap(xrange, yrange)
-        if transposed:
-            self.bitmap = [list(z) for z in zip(*self.bitmap)]
-        return self
+        return self._apply(_rotate_transform(angle, self.width, self.height))
         
     def flip(self, vertical=False):
         '''In-place horizontal (default) or vertical flip of the sprite.
 
         Returns itself, so this function can be chained.
         '''
-        if vertical:
-            xrange, yrange = range(self.width), reversed(range(self.height))
-        else:
-            xrange, yrange = reversed(range(self.width)), range(self.height)
-        self._recreate_bitmap(xrange, yrange)
-        return self
+        return self._apply(_flip_transform(vertical, self.width, self.height))
+
+    def view(self):
+        '''Returns a `SpriteView` of the sprite's current bitmap.
+
+        Unlike the in-place transforms, the view's transforms don't copy any
+        pixels: they return new views, and the transform is applied when the
+        view is drawn.
+        '''
+        compiled = self._compiled()
+        return SpriteView(compiled, _identity_transform(compiled.width, compiled.height))
 
     def __str__(self):
         return _color_array_to_str(self.bitmap, self.height, self.width)
@@ -202,9 +516,167 @@ class Sprite(object):
 
         Returns itself, so this function can be chained.
         '''
-        self.bitmap = self.original_bitmap
+        self._rebase(self.original_bitmap, self._original_serial)
         return self
         
+class SpriteView(object):
+    '''A rotated, flipped and/or cropped view of a `Sprite`, as returned by
+    `Sprite.view()`.
+
+    A `SpriteView` is drawable on the LED Matrix `FrameBuffer` with the
+    `FrameBuffer`'s `draw()` function.  Its `rotate()`, `flip()` and `crop()`
+    functions take the same arguments as the `Sprite`'s, but leave the view
+    unchanged and return a new view, so they can be chained:
+
+        fb.draw(sprite.view().rotate(90).flip().crop((1, 1), (4, 4)))
+    '''
+    def __init__(self, compiled, transform):
+        self._base = compiled
+        self._transform = transform
+
+    @property
+    def width(self):
+        '''Returns the width of the view.
+        '''
+        return self._transform[6]
+
+    @property
+    def height(self):
+        '''Returns the height of the view.
+        '''
+        return self._transform[7]
+
+    def _view(self, transform):
+        return SpriteView(self._base, _compose_transforms(self._transform, transform))
+
+    def crop(self, origin=(0,0), dimensions=None):
+        '''Returns a cropped view.
+        '''
+        return self._view(_crop_transform(origin, dimensions, self.width, self.height))
+
+    def rotate(self, angle=90):
+        '''Returns a view rotated clockwise by `angle`, a multiple of 90.
+        '''
+        return self._view(_rotate_transform(angle, self.width, self.height))
+
+    def flip(self, vertical=False):
+        '''Returns a horizontally (default) or vertically flipped view.
+        '''
+        return self._view(_flip_transform(vertical, self.width, self.height))
+
+    def reset(self):
+        '''Returns an untransformed view of the sprite.
+        '''
+        return SpriteView(self._base, _identity_transform(self._base.width, self._base.height))
+
+class SpriteSheet(object):
+    '''A sequence of equal-sized `Sprite` frames, sliced from a single sprite
+    (the sheet).
+
+    Frames are read from the sheet left to right, then top to bottom, and are
+    compiled for drawing up front.  A `SpriteSheet` can be indexed, iterated,
+    and used to create an `Animation`.
+    '''
+    def __init__(self, sheet, frame_width, frame_height=None, count=None):
+        '''Creates a `SpriteSheet` by slicing `sheet` (a `Sprite`, or the
+        name of a sprite file) into frames of `frame_width` by `frame_height`
+        (by default, the height of the sheet).
+
+        `count` is the number of frames, if the sheet has unused frames at
+        its end.
+        '''
+        if not isinstance(sheet, Sprite):
+            sheet = Sprite.from_file(sheet)
+        if frame_height is None:
+            frame_height = sheet.height
+        if frame_width <= 0 or frame_height <= 0:
+            raise ValueError('Frame dimensions must be positive')
+        columns, rows = sheet.width // frame_width, sheet.height // frame_height
+        if count is None:
+            count = columns * rows
+        elif count > columns * rows:
+            raise ValueError('Sheet has only {} frames'.format(columns * rows))
+
+        bitmap = sheet.bitmap
+        self.frames = []
+        for i in range(count):
+            x = (i % columns) * frame_width
+            y = sheet.height - (i // columns + 1) * frame_height
+            frame = Sprite.__new__(Sprite)
+            frame._set_original(_apply_transform(bitmap, (x, 1, 0, y, 0, 1, frame_width, frame_height)))
+            frame._compiled()
+            self.frames.append(frame)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+class Animation(object):
+    '''Plays a sequence of `Sprite` frames (such as a `SpriteSheet`) at a
+    fixed frame rate.
+
+    An `Animation` is drawable on the LED Matrix `FrameBuffer` with the
+    `FrameBuffer`'s `draw()` function, which draws the frame due at the time
+    it is drawn.  Choosing the frame allocates nothing, so an animation can be
+    drawn every frame of a game loop.
+    '''
+    def __init__(self, frames, fps=10, loop=True):
+        '''Creates an `Animation` of `frames` (a `SpriteSheet`, or a list of
+        `Sprite`s), played at `fps` frames per second.
+
+        If `loop` is False, the animation stops at its last frame.
+        '''
+        self.frames = list(frames)
+        if not self.frames:
+            raise ValueError('An Animation needs at least one frame')
+        self.fps = fps
+        self.loop = loop
+        self.start()
+
+    def start(self, timestamp=None):
+        '''(Re)starts the animation from its first frame, at `timestamp` (by
+        default, now, from `time.monotonic()`).
+        '''
+        self._start = time.monotonic() if timestamp is None else timestamp
+
+    def index(self, timestamp=None):
+        '''Returns the index of the frame due at `timestamp` (by default, now).
+        '''
+        if timestamp is None:
+            timestamp = time.monotonic()
+        index = int((timestamp - self._start) * self.fps)
+        if index < 0:
+            return 0
+        if self.loop:
+            return index % len(self.frames)
+        return min(index, len(self.frames) - 1)
+
+    def frame(self, timestamp=None):
+        '''Returns the frame due at `timestamp` (by default, now).
+        '''
+        return self.frames[self.index(timestamp)]
+
+    def done(self, timestamp=None):
+        '''Returns True if a non-looping animation has reached its last frame.
+        '''
+        return not self.loop and self.index(timestamp) == len(self.frames) - 1
+
+    @property
+    def width(self):
+        return self.frame().width
+
+    @property
+    def height(self):
+        return self.frame().height
+
+    def _compiled(self):
+        return self.frame()._compiled()
+
 class Text(Sprite):
     '''A string of text writable to the framebuffer.
 
@@ -221,21 +693,30 @@ class Text(Sprite):
 
         `char_spacing` is the number of blank pixels that are put between two
         characters in a string.
+
+        Fonts are loaded once, and then shared by all `Text` objects.
         '''
-        with open(self._font_path(font_dir, font_name, message[0])) as f:
-            super().__init__(f.read())
-        if len(message) > 1:
-            self.__add__(Sprite((('-' * char_spacing) + '\n') * self.height))
-            self.__add__(Text(message[1:]))
+        font = _load_font(self._font_dir(font_dir), font_name)
+        spacing = [(-1,) * font.height] * char_spacing
+        columns = []
+        for i, char in enumerate(message):
+            if i:
+                columns += spacing
+            columns += _font_glyph(font, char)
+        self._set_original([list(column) for column in columns])
 
     @classmethod
-    def from_file(cls, filename):
-        super().from_file(filename)
+    def from_file(cls, filename, *args, **kwargs):
+        '''Creates a `Text` object from the text in a file.
+        '''
+        with open(filename) as f:
+            return cls(f.read(), *args, **kwargs)
         
     @classmethod
     def font_list(cls, font_dir=None):
         font_dir = cls._font_dir(font_dir)
-        return [d for d in os.glob(font_dir) if os.path.isdir(d)]
+        return sorted(d for d in os.listdir(font_dir)
+            if os.path.isdir(os.path.join(font_dir, d)))
 
     @staticmethod
     def _font_dir(font_dir=None):
@@ -247,28 +728,852 @@ class Text(Sprite):
             raise IOError('Font path does not exist.')
 
         return font_dir
-        
-    def _font_path(self, font_dir, font_name, char):
-        font_path = os.path.join(self._font_dir(), font_name)
-        unknown_font_path = os.path.join(font_path, 'unknown.spr')
-        
-        if char.isdigit():
-            font_path = os.path.join(font_path, 'numbers', char + '.spr')
-        elif char.isupper():
-            font_path = os.path.join(font_path, 'upper', char + '.spr')
-        elif char.islower():
-            font_path = os.path.join(font_path, 'lower', char + '.spr')
-        elif char.isspace():
-            font_path = os.path.join(font_path, 'space.spr')
+
+_Font = namedtuple('_Font', 'height glyphs space unknown')
+
+def _font_glyph(font, char):
+    glyph = font.glyphs.get(char)
+    if glyph is None:
+        glyph = font.space if char.isspace() and font.space else font.unknown
+    return glyph
+
+# Fonts loaded by _load_font(), keyed by font path
+_fonts = {}
+
+def _load_font(font_dir, font_name):
+    '''Returns the named font from `font_dir`, loading it on first use.
+
+    The font is loaded from its font bundle, `<font_name>.fnt`, if there is
+    one, otherwise from its directory of sprite files (see
+    `_load_font_sprites()`).
+    '''
+    font_path = os.path.abspath(os.path.join(font_dir, font_name))
+    try:
+        return _fonts[font_path]
+    except KeyError:
+        pass
+
+    if os.path.isfile(font_path + FONT_BUNDLE_EXT):
+        font = _load_font_bundle(font_path + FONT_BUNDLE_EXT)
+    elif os.path.isdir(font_path):
+        font = _load_font_sprites(font_path)
+    else:
+        raise IOError('Font does not exist: ' + font_name)
+    _fonts[font_path] = font
+    return font
+
+def _load_font_sprites(font_path):
+    '''Loads a font from a directory of sprite files, one per character:
+
+        numbers/<char>.spr      Digits
+        upper/<char>.spr        Upper case letters
+        lower/<char>.spr        Lower case letters
+        misc/<code point>.spr   Other characters, by decimal code point
+        space.spr               Space (used for all whitespace)
+        unknown.spr             Characters not in the font
+
+    The loaded font maps each character to its glyph, as a list of columns.
+    '''
+    def glyph(path):
+        with open(path) as f:
+            return [tuple(column) for column in Sprite(f.read()).bitmap]
+
+    glyphs = {}
+    for subdir in ['numbers', 'upper', 'lower', 'misc']:
+        subdir_path = os.path.join(font_path, subdir)
+        if not os.path.isdir(subdir_path):
+            continue
+        for filename in os.listdir(subdir_path):
+            name, ext = os.path.splitext(filename)
+            if ext != '.spr':
+                continue
+            if subdir == 'misc':
+                try:
+                    char = chr(int(name))
+                except ValueError:
+                    continue
+            else:
+                char = name
+            glyphs[char] = glyph(os.path.join(subdir_path, filename))
+
+    unknown = glyph(os.path.join(font_path, 'unknown.spr'))
+    space_path = os.path.join(font_path, 'space.spr')
+    space = glyph(space_path) if os.path.isfile(space_path) else None
+
+    return _Font(len(unknown[0]), glyphs, space, unknown)
+
+# A font bundle packs a whole font into one file, built from the font's sprite
+# files by scripts/compile_fonts.  All values are little-endian:
+#
+#   header      magic (4s), version (H), height (H), slot width (H),
+#               reserved (H), number of glyphs (I)
+#   index       For each glyph, sorted by code point: code point (I), width
+#               (H), reserved (H).  The unknown glyph has code point
+#               FONT_BUNDLE_UNKNOWN, and the space glyph is code point 32.
+#   bitmaps     For each glyph, in index order, a slot of slot width * height
+#               bytes: the glyph's columns, bottom to top, one byte per pixel
+#               (0xFF for transparent), followed by unused columns.
+FONT_BUNDLE_EXT = '.fnt'
+FONT_BUNDLE_MAGIC = b'RSFN'
+FONT_BUNDLE_VERSION = 1
+FONT_BUNDLE_UNKNOWN = 0xFFFFFFFF
+_FONT_BUNDLE_HEADER = struct.Struct('<4sHHHHI')
+_FONT_BUNDLE_INDEX = struct.Struct('<IHH')
+
+class _FontBundleGlyphs(object):
+    '''The glyphs of a memory mapped font bundle, as a read-only mapping of
+    characters to glyphs.  Each glyph is decoded on first use.
+    '''
+    def __init__(self, data, height, slot_width, index):
+        self._data = data
+        self._height = height
+        self._slot_size = slot_width * height
+        self._bitmaps_offset = _FONT_BUNDLE_HEADER.size + len(index) * _FONT_BUNDLE_INDEX.size
+        self._index = index
+        self._decoded = {}
+
+    def glyph(self, code_point):
+        try:
+            return self._decoded[code_point]
+        except KeyError:
+            pass
+        slot, width = self._index[code_point]
+        offset = self._bitmaps_offset + slot * self._slot_size
+        height = self._height
+        pixels = self._data[offset:offset + width * height]
+        glyph = [tuple(-1 if pixel == 0xFF else pixel for pixel in pixels[x*height:(x + 1)*height])
+            for x in range(width)]
+        self._decoded[code_point] = glyph
+        return glyph
+
+    def get(self, char, default=None):
+        code_point = ord(char)
+        if code_point not in self._index:
+            return default
+        return self.glyph(code_point)
+
+def _load_font_bundle(bundle_path):
+    '''Loads a font from a font bundle.
+
+    The bundle is memory mapped, and only its index is read up front.
+    '''
+    with open(bundle_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, height, slot_width, reserved, num_glyphs = \
+        _FONT_BUNDLE_HEADER.unpack_from(data)
+    if magic != FONT_BUNDLE_MAGIC or version != FONT_BUNDLE_VERSION:
+        raise ValueError('Not a version {} font bundle: {}'.format(FONT_BUNDLE_VERSION, bundle_path))
+
+    index = {}
+    offset = _FONT_BUNDLE_HEADER.size
+    for slot in range(num_glyphs):
+        code_point, width, reserved = _FONT_BUNDLE_INDEX.unpack_from(data, offset)
+        index[code_point] = (slot, width)
+        offset += _FONT_BUNDLE_INDEX.size
+
+    glyphs = _FontBundleGlyphs(data, height, slot_width, index)
+    unknown = glyphs.glyph(FONT_BUNDLE_UNKNOWN)
+    space = glyphs.get(' ')
+    return _Font(height, glyphs, space, unknown)
+
+# A column of a ScrollingText, compiled for drawing (see _compile_bitmap())
+_CompiledColumn = namedtuple('_CompiledColumn', 'pixels mask runs')
+
+def _compile_column(column):
+    compiled = _compile_bitmap([column])
+    return _CompiledColumn(compiled.pixels, compiled.mask, compiled.runs[0])
+
+class ScrollingText(object):
+    '''Text that scrolls from right to left through a window of fixed width.
+
+    The text comes from `source`, which is either a string, or an iterable of
+    strings (such as a generator, or a file, which is read a line at a time).
+    Columns of text are rendered only as they scroll into the window, so the
+    memory used and the time taken to draw each frame do not depend on the
+    length of the text, and `source` may even be endless.
+
+    A `ScrollingText` is drawable on the LED Matrix `FrameBuffer` with the
+    `FrameBuffer`'s `draw()` function.  It starts out blank, and each call to
+    `step()` scrolls it one column to the left:
+
+        scroller = ScrollingText('Hello World', fb.width)
+        def update():
+            fb.erase()
+            fb.draw(scroller)
+            return scroller.step()
+        fb.run(update, fps=20)
+
+    To repeat text forever, pass `itertools.cycle([message + '   '])` as the
+    `source`.
+    '''
+    def __init__(self, source, width, char_spacing=1, font_name='5x7', font_dir=None):
+        '''Creates a `ScrollingText` object of the given `width`, reading text
+        from `source`.
+
+        `char_spacing`, `font_name` and `font_dir` are as for `Text`.
+        '''
+        font = _load_font(Text._font_dir(font_dir), font_name)
+        self._width = width
+        self._height = font.height
+        self._blank = _compile_column((-1,) * font.height)
+        self._columns = self._render(font, source, char_spacing)
+        self._pixels = bytearray(width * font.height)
+        self._mask = bytearray(width * font.height)
+        self._runs = deque([[]] * width, maxlen=width)
+        self._trailing_columns = 0
+        self._compiled_bitmap = None
+
+    def _render(self, font, source, char_spacing):
+        '''Yields the compiled columns of the text in `source`.
+        '''
+        compiled_glyphs = {}
+        first = True
+        for chunk in source:
+            for char in chunk:
+                if not first:
+                    for i in range(char_spacing):
+                        yield self._blank
+                first = False
+                try:
+                    compiled_glyph = compiled_glyphs[char]
+                except KeyError:
+                    compiled_glyph = [_compile_column(column) for column in _font_glyph(font, char)]
+                    compiled_glyphs[char] = compiled_glyph
+                for column in compiled_glyph:
+                    yield column
+
+    @property
+    def width(self):
+        '''Returns the width of the window the text scrolls through.
+        '''
+        return self._width
+
+    @property
+    def height(self):
+        '''Returns the height of the text.
+        '''
+        return self._height
+
+    def step(self, columns=1):
+        '''Scrolls the text left by `columns`.
+
+        Returns False once all the text has scrolled out of the window (and the
+        `source` is exhausted), otherwise True.
+        '''
+        height = self._height
+        for i in range(columns):
+            column = next(self._columns, None)
+            if column is None:
+                column = self._blank
+                self._trailing_columns += 1
+            del self._pixels[:height]
+            self._pixels += column.pixels
+            del self._mask[:height]
+            self._mask += column.mask
+            self._runs.append(column.runs)
+        self._compiled_bitmap = None
+        return self._trailing_columns < self._width
+
+    def _compiled(self):
+        if self._compiled_bitmap is None:
+            self._compiled_bitmap = _CompiledBitmap(self._width, self._height,
+                bytes(self._pixels), bytes(self._mask), list(self._runs),
+                0 not in self._mask)
+        return self._compiled_bitmap
+
+def _percentile(samples, percent):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+class FrameClock(object):
+    '''Paces a frame loop at a fixed frame rate, and keeps frame timing statistics.
+
+    Frames are scheduled against deadlines on a monotonic clock, one frame
+    period apart, so the frame rate does not drift however long each frame
+    takes.  A frame loop using a `FrameClock` looks like:
+
+        clock = FrameClock(fps=30)
+        while True:
+            clock.wait()
+            <update and draw the frame>
+            clock.rendered()
+            fb.show()
+            clock.shown()
+
+    `FrameBuffer.run()` wraps this loop.
+    '''
+    def __init__(self, fps=30):
+        '''Creates a `FrameClock` that paces frames at `fps` frames per second.
+        '''
+        if fps <= 0:
+            raise ValueError('fps must be a positive number')
+        self.fps = fps
+        self.period = 1.0 / fps
+        self.reset()
+
+    def reset(self):
+        '''Resets the frame schedule and the statistics.
+        '''
+        self._deadline = None
+        self._start = self._render_end = None
+        self.frames = 0     #: Number of frames shown
+        self.skipped = 0    #: Number of frames skipped because the loop was behind
+        self.missed = 0     #: Number of frames that finished after their deadline
+        self._render_times = deque(maxlen=FRAME_HISTORY)
+        self._show_times = deque(maxlen=FRAME_HISTORY)
+        self._jitters = deque(maxlen=FRAME_HISTORY)
+
+    def wait(self):
+        '''Sleeps until it is time to start the next frame.
+
+        If the frame loop has fallen a full frame period (or more) behind,
+        this does not sleep.  Instead, the frames that can no longer be shown
+        on time are skipped, and the next frame is scheduled in the current
+        frame period.
+
+        Returns the number of frames skipped.
+        '''
+        now = time.monotonic()
+        if self._deadline is None:
+            self._deadline = now
+        late = now - self._deadline
+        skipped = 0
+        if late >= self.period:
+            skipped = int(late / self.period)
+            self._deadline += skipped * self.period
+            self.skipped += skipped
+        elif late < 0:
+            time.sleep(-late)
+            now = time.monotonic()
+        self._jitters.append(now - self._deadline)
+        self._start = now
+        return skipped
+
+    def rendered(self):
+        '''Marks the end of updating and drawing the current frame.
+        '''
+        self._render_end = time.monotonic()
+
+    def shown(self):
+        '''Marks the end of showing the current frame, and schedules the next.
+        '''
+        now = time.monotonic()
+        start = self._start if self._start is not None else now
+        render_end = self._render_end if self._render_end is not None else start
+        self._render_times.append(render_end - start)
+        self._show_times.append(now - render_end)
+        self.frames += 1
+        if self._deadline is None:
+            self._deadline = now
+        self._deadline += self.period
+        if now > self._deadline:
+            self.missed += 1
+        self._start = self._render_end = None
+
+    def stats(self):
+        '''Returns a dictionary of frame timing statistics.
+
+        Times are in seconds, over the most recent `FRAME_HISTORY` frames:
+        the mean and max time to render (update and draw) a frame, the mean
+        and max time to show a frame (mostly the SPI transfer), and the 50th,
+        95th and 99th percentiles of the frame start jitter (how late each
+        frame started relative to its schedule).  Also includes the counts of
+        frames shown, skipped and missed.
+        '''
+        def mean(samples):
+            return sum(samples) / len(samples) if samples else 0.0
+        def maximum(samples):
+            return max(samples) if samples else 0.0
+        return {
+            'fps' : self.fps,
+            'frames' : self.frames,
+            'skipped' : self.skipped,
+            'missed' : self.missed,
+            'render_mean' : mean(self._render_times),
+            'render_max' : maximum(self._render_times),
+            'show_mean' : mean(self._show_times),
+            'show_max' : maximum(self._show_times),
+            'jitter_p50' : _percentile(self._jitters, 50),
+            'jitter_p95' : _percentile(self._jitters, 95),
+            'jitter_p99' : _percentile(self._jitters, 99),
+        }
+
+class _Canvas(object):
+    '''A canvas of `width` x `height` pixels, stored as one byte per pixel in
+    the bytearray `fb`, column-major (pixel (x, y) is at `fb[x*height + y]`).
+
+    Provides the drawing functions shared by `FrameBuffer` and `Layer`.
+    '''
+    def _framebuffer(self):
+        height = self._height
+        return [list(self.fb[x:x + height]) for x in range(0, len(self.fb), height)]
+
+    def point(self, x, y=None, color=0xF):
+        ''' Draw point (`x`, `y`) in the framebuffer, using the given `color`.
+
+        For convenience, this function accepts a 2-tuple point as `x` if `y` is
+        None.  So, for example, both of the following are allowed:
+
+            fb.point(2,3)
+
+        or
+
+            fb.point((2,3))
+
+        The point is drawn in the given `color`.
+        '''
+        try:
+            if y == None:
+                x, y = x
+            if x < 0 or y < 0 or x >= self._width or y >= self._height:
+                raise IndexError
+            if color >= 0:
+                self.fb[x*self._height + y] = color
+        except IndexError:
+            pass
+
+    def erase(self, color=0):
+        '''Erase all pixels in the framebuffer
+
+        `color`, if given, can fill the framebuffer with a specific color.
+        '''
+        self.fb[:] = bytes([color & 0xFF]) * len(self.fb)
+
+    @property
+    def dirty(self):
+        '''True if the pixels have changed since they were last composited by
+        `FrameBuffer.show()` (only tracked while the `FrameBuffer` has layers).
+        '''
+        return self._composited is None or self.fb != self._composited
+
+    def _outcode(self, x, y):
+        '''Returns the Cohen-Sutherland outcode of (x, y): a bit each for left
+        of, right of, below and above the framebuffer.
+        '''
+        return ((x < 0) | (x >= self._width) << 1
+            | (y < 0) << 2 | (y >= self._height) << 3)
+
+    def _column_span(self, x, y_start, y_end, color):
+        '''Fills column `x` from `y_start` to `y_end` (inclusive), clipped to
+        the framebuffer, in one slice assignment.
+        '''
+        if x < 0 or x >= self._width:
+            return
+        y_start, y_end = max(y_start, 0), min(y_end, self._height - 1)
+        if y_start <= y_end:
+            offset = x*self._height
+            self.fb[offset + y_start:offset + y_end + 1] = bytes([color]) * (y_end - y_start + 1)
+
+    def line(self, point_a, point_b, color=0xF):
+        '''Draw a line in the framebuffer from `point_a` to `point_b`.
+
+        The line is drawn with the given `color`.
+        '''
+        # Draws the same points as Bresenham's Line Algorithm
+        # (http://en.wikipedia.org/wiki/Bresenham's_line_algorithm), but only
+        # those within the framebuffer.  Lines entirely to one side of the
+        # framebuffer are rejected by their Cohen-Sutherland outcodes, and
+        # others are clipped to the range of steps along the line that are
+        # within the framebuffer.
+        if color < 0:
+            return
+        x1, y1 = point_a
+        x2, y2 = point_b
+        if self._outcode(x1, y1) & self._outcode(x2, y2):
+            return
+        if x1 == x2:
+            self._column_span(x1, min(y1, y2), max(y1, y2), color)
+            return
+
+        # Step along the major axis (the one the line is longer in).  After
+        # n steps, Bresenham's algorithm has taken (2*n*minor + major - 1) //
+        # (2*major) steps along the minor axis.
+        dx, dy = abs(x2 - x1), abs(y2 - y1)
+        sx, sy = (1 if x1 < x2 else -1), (1 if y1 < y2 else -1)
+        if dx >= dy:
+            major, minor = dx, dy
+            major_start, major_sign, major_size = x1, sx, self._width
+            minor_start, minor_sign, minor_size = y1, sy, self._height
         else:
-            font_path = os.path.join(font_path, 'misc', str(ord(char)) + '.spr')
-            
-        if not os.path.isfile(font_path):
-            return unknown_font_path
+            major, minor = dy, dx
+            major_start, major_sign, major_size = y1, sy, self._height
+            minor_start, minor_sign, minor_size = x1, sx, self._width
+
+        def steps_within(start, sign, size):
+            # The range of steps, n, for which start + sign*n is in [0, size)
+            if sign > 0:
+                return -start, size - 1 - start
+            return start - (size - 1), start
+
+        n_start, n_end = steps_within(major_start, major_sign, major_size)
+        n_start, n_end = max(n_start, 0), min(n_end, major)
+        k_start, k_end = steps_within(minor_start, minor_sign, minor_size)
+        if minor:
+            n_start = max(n_start, -((major - 1 - 2*major*k_start) // (2*minor)))
+            n_end = min(n_end, (2*major*(k_end + 1) - major) // (2*minor))
+        elif not k_start <= 0 <= k_end:
+            return
+
+        fb, height = self.fb, self._height
+        for n in range(n_start, n_end + 1):
+            major_pos = major_start + major_sign*n
+            minor_pos = minor_start + minor_sign*((2*n*minor + major - 1) // (2*major))
+            if dx >= dy:
+                fb[major_pos*height + minor_pos] = color
+            else:
+                fb[minor_pos*height + major_pos] = color
+
+    def rect(self, origin, dimensions, fill=False, color=0xF):
+        '''Draws a rectangle in the framebuffer.
 
-        return font_path
+        The `origin` is the lower left position of the rectangle.  The
+        `dimensions` is a 2-tuple of the width and height.  A width and height
+        of 1 would be a 1 point rectangle.
+
+        If `fill` is True, then the interior of the rectanle will be filled.
+        Otherwise, only the outside edge of the rectandle will be drawn.  The
+        rectangle is drawn in the given `color`.
+        '''
+        x, y = origin
+        width, height = dimensions
+
+        if fill:
+            if color < 0 or width <= 0 or height <= 0:
+                return
+            x_start, x_end = max(x, 0), min(x + width, self._width)
+            y_start, y_end = max(y, 0), min(y + height, self._height)
+            if x_start >= x_end or y_start >= y_end:
+                return
+            if y_start == 0 and y_end == self._height:
+                # Whole columns are contiguous, so fill them all at once
+                self.fb[x_start*self._height:x_end*self._height] = \
+                    bytes([color]) * ((x_end - x_start)*self._height)
+            else:
+                for column in range(x_start, x_end):
+                    self._column_span(column, y_start, y_end - 1, color)
+        else:
+            self.line((x, y), (x, y + height - 1), color)
+            self.line((x, y + height - 1), (x + width - 1, y + height - 1), color)
+            self.line((x + width - 1, y + height - 1), (x + width - 1, y), color)
+            self.line((x + width - 1, y), (x, y), color)
+
+    def circle(self, center, radius, fill=False, color=0xF):
+        '''Draws a circle in the framebuffer, centered at `center`, with the
+        given `radius`.
+
+        If `fill` is True, then the interior of the circle will be filled.
+        The circle is drawn in the given `color`.
+        '''
+        if color < 0:
+            return
+        # Uses the Midpoint Circle Algorithm, which finds the points of one
+        # octant, (x, y), that are mirrored into the other seven.
+        # http://en.wikipedia.org/wiki/Midpoint_circle_algorithm
+        cx, cy = center
+        x, y = radius, 0
+        err = 1 - radius
+        while x >= y:
+            if fill:
+                for column, half_height in ((cx - x, y), (cx + x, y), (cx - y, x), (cx + y, x)):
+                    self._column_span(column, cy - half_height, cy + half_height, color)
+            else:
+                for dx, dy in ((x, y), (y, x)):
+                    self.point(cx + dx, cy + dy, color)
+                    self.point(cx - dx, cy + dy, color)
+                    self.point(cx + dx, cy - dy, color)
+                    self.point(cx - dx, cy - dy, color)
+            y += 1
+            if err < 0:
+                err += 2*y + 1
+            else:
+                x -= 1
+                err += 2*(y - x) + 1
+
+    def ellipse(self, center, radii, fill=False, color=0xF):
+        '''Draws an ellipse in the framebuffer, centered at `center`, with
+        `radii` a 2-tuple of the horizontal and vertical radius.
+
+        If `fill` is True, then the interior of the ellipse will be filled.
+        The ellipse is drawn in the given `color`.
+        '''
+        if color < 0:
+            return
+        cx, cy = center
+        rx, ry = radii
+        if rx <= 0 or ry <= 0:
+            self.line((cx - rx, cy - ry), (cx + rx, cy + ry), color)
+            return
+
+        def plot(x, y):
+            if fill:
+                self._column_span(cx - x, cy - y, cy + y, color)
+                self._column_span(cx + x, cy - y, cy + y, color)
+            else:
+                self.point(cx + x, cy + y, color)
+                self.point(cx - x, cy + y, color)
+                self.point(cx + x, cy - y, color)
+                self.point(cx - x, cy - y, color)
+
+        # Uses the Midpoint Ellipse Algorithm, in two regions of the first
+        # quadrant (mirrored into the others): where the slope is shallower
+        # than -1, stepping in x, then where it's steeper, stepping in y.
+        rx2, ry2 = rx*rx, ry*ry
+        x, y = 0, ry
+        px, py = 0, 2*rx2*y
+        p = ry2 - rx2*ry + rx2/4
+        while px < py:
+            plot(x, y)
+            x += 1
+            px += 2*ry2
+            if p < 0:
+                p += ry2 + px
+            else:
+                y -= 1
+                py -= 2*rx2
+                p += ry2 + px - py
+        p = ry2*(x + 0.5)**2 + rx2*(y - 1)**2 - rx2*ry2
+        while y >= 0:
+            plot(x, y)
+            y -= 1
+            py -= 2*rx2
+            if p > 0:
+                p += rx2 - py
+            else:
+                x += 1
+                px += 2*ry2
+                p += rx2 - py + px
+
+    def polygon(self, points, fill=False, color=0xF):
+        '''Draws a closed polygon in the framebuffer, with corners at the
+        given list of `points`.
+
+        If `fill` is True, then the interior of the polygon will be filled.
+        Otherwise, only the edges of the polygon are drawn.  The polygon is
+        drawn in the given `color`.
+        '''
+        points = list(points)
+        edges = list(zip(points, points[1:] + points[:1]))
+        for point_a, point_b in edges:
+            self.line(point_a, point_b, color)
+        if not fill or color < 0 or not points:
+            return
+
+        # Scan converts the polygon a column at a time (the framebuffer is
+        # stored in columns): each column is filled between pairs of the
+        # points where it crosses the edges.
+        x_start = max(min(x for x, y in points), 0)
+        x_end = min(max(x for x, y in points), self._width - 1)
+        for column in range(x_start, x_end + 1):
+            crossings = sorted(ya + (column - xa)*(yb - ya)/(xb - xa)
+                for (xa, ya), (xb, yb) in edges
+                if min(xa, xb) <= column < max(xa, xb))
+            for y_start, y_end in zip(crossings[::2], crossings[1::2]):
+                self._column_span(column, int(-(-y_start // 1)), int(y_end // 1), color)
+
+    def triangle(self, point_a, point_b, point_c, fill=False, color=0xF):
+        '''Draws a triangle in the framebuffer, with corners `point_a`,
+        `point_b` and `point_c`.
+
+        If `fill` is True, then the interior of the triangle will be filled.
+        The triangle is drawn in the given `color`.
+        '''
+        self.polygon([point_a, point_b, point_c], fill, color)
+
+    @property
+    def width(self):
+        '''Returns the width of the framebuffer.
+
+        The width depends upon the matrix layout.
+        '''
+        return self._width
+
+    @property
+    def height(self):
+        '''Returns the height of the framebuffer.
+
+        The height depends upon the matrix layout.
+        '''
+        return self._height
+
+    def __str__(self):
+        return _color_array_to_str(self._framebuffer(), self.height, self.width)
+
+    def draw(self, drawable, origin=(0,0)):
+        '''Draw `drawable` into the framebuffer, at given origin.
+
+        `drawable` is a `Sprite`, `SpriteView`, `Text`, `ScrollingText` or
+        `Animation` object.
+        '''
+        if isinstance(drawable, SpriteView):
+            self._draw_view(drawable, origin)
+            return
+
+        xorig, yorig = origin
+        compiled = drawable._compiled()
+        if not compiled.width:
+            return
+
+        # Clip the drawable to the framebuffer, so that only the visible
+        # region is copied.
+        x_start, x_end = max(xorig, 0), min(xorig + compiled.width, self._width)
+        y_start, y_end = max(yorig, 0), min(yorig + compiled.height, self._height)
+        if x_start >= x_end or y_start >= y_end:
+            return
+
+        fb, height = self.fb, self._height
+        pixels, sprite_height = compiled.pixels, compiled.height
+        if compiled.opaque and sprite_height == height and yorig == 0:
+            # Visible columns are contiguous in both the sprite and the
+            # framebuffer, so copy them all at once.
+            fb[x_start*height:x_end*height] = \
+                pixels[(x_start - xorig)*height:(x_end - xorig)*height]
+        elif compiled.opaque:
+            sprite_y_start, sprite_y_end = y_start - yorig, y_end - yorig
+            for x in range(x_start, x_end):
+                sprite_offset = (x - xorig)*sprite_height
+                fb[x*height + y_start:x*height + y_end] = \
+                    pixels[sprite_offset + sprite_y_start:sprite_offset + sprite_y_end]
+        else:
+            sprite_y_start, sprite_y_end = y_start - yorig, y_end - yorig
+            runs = compiled.runs
+            for x in range(x_start, x_end):
+                sprite_offset = (x - xorig)*sprite_height
+                offset = x*height + yorig
+                for start, end in runs[x - xorig]:
+                    if start < sprite_y_start:
+                        start = sprite_y_start
+                    if end > sprite_y_end:
+                        end = sprite_y_end
+                    if end - start == 1:
+                        fb[offset + start] = pixels[sprite_offset + start]
+                    elif start < end:
+                        fb[offset + start:offset + end] = \
+                            pixels[sprite_offset + start:sprite_offset + end]
+
+    def _draw_view(self, view, origin):
+        xorig, yorig = origin
+        base = view._base
+        x0, xu, xv, y0, yu, yv, width, height = view._transform
+        x_start, x_end = max(xorig, 0), min(xorig + width, self._width)
+        y_start, y_end = max(yorig, 0), min(yorig + height, self._height)
+        if x_start >= x_end or y_start >= y_end:
+            return
+
+        # With the base pixels flattened column-major, the view's pixel (u, v)
+        # is at index + u*u_step + v*v_step, so each visible column of the
+        # view is a (possibly reversed) strided slice of the base pixels.
+        base_height = base.height
+        index = x0*base_height + y0
+        u_step = xu*base_height + yu
+        v_step = xv*base_height + yv
+        fb, fb_height = self.fb, self._height
+        length = y_end - y_start
+        for x in range(x_start, x_end):
+            start = index + (x - xorig)*u_step + (y_start - yorig)*v_step
+            end = start + length*v_step
+            column = slice(start, end if end >= 0 else None, v_step)
+            offset = x*fb_height
+            if base.opaque:
+                fb[offset + y_start:offset + y_end] = base.pixels[column]
+            else:
+                _blend(fb, offset + y_start, base.pixels[column], base.mask[column])
+
+    @property
+    def __array_interface__(self):
+        '''The framebuffer as a writable NumPy array of colors, indexed
+        [x, y], so that, for example:
+
+            pixels = numpy.asarray(fb)
+            pixels[:, 0] = 0xF         # Light the bottom row
+            pixels[:] = image[::-1].T  # Copy a row-major image
+
+        A row-major image (such as a camera frame) has its top row first,
+        while y=0 is the bottom row of the framebuffer, so the image's rows
+        are reversed before transposing it - otherwise it is upside down.
+
+        The array shares the framebuffer's memory.
+        '''
+        return {
+            'version' : 3,
+            'shape' : (self._width, self._height),
+            'typestr' : '|u1',
+            'data' : self.fb,
+            }
+
+    def blit_array(self, array, origin=(0,0), mask=None):
+        '''Copy a 2-dimensional array of colors into the framebuffer, at
+        the given origin.
+
+        `array` is indexed [x, y], like the framebuffer's own array (see
+        `__array_interface__`).  It is either an array of 1 byte elements that
+        supports the buffer protocol (such as a `numpy.uint8` or `numpy.int8`
+        array, or a 2-dimensional `memoryview`), or a sequence of columns.
+        Colors of -1 (0xFF) are transparent, as are the pixels where `mask`,
+        an array of the same shape, is 0.
+
+        Opaque arrays are copied a column at a time (or, for full height
+        arrays, all at once).
+        '''
+        xorig, yorig = origin
+        width, height, pixels, opaque_mask = _array_pixels(array, mask)
+        x_start, x_end = max(xorig, 0), min(xorig + width, self._width)
+        y_start, y_end = max(yorig, 0), min(yorig + height, self._height)
+        if x_start >= x_end or y_start >= y_end:
+            return
+
+        fb, fb_height = self.fb, self._height
+        opaque = 0 not in opaque_mask
+        if opaque and height == fb_height and yorig == 0:
+            fb[x_start*fb_height:x_end*fb_height] = \
+                pixels[(x_start - xorig)*height:(x_end - xorig)*height]
+            return
+        for x in range(x_start, x_end):
+            start = (x - xorig)*height + y_start - yorig
+            end = start + y_end - y_start
+            if opaque:
+                fb[x*fb_height + y_start:x*fb_height + y_end] = pixels[start:end]
+            else:
+                _blend(fb, x*fb_height + y_start, pixels[start:end], opaque_mask[start:end])
+
+
+class Layer(_Canvas):
+    '''A transparent canvas drawn over the `FrameBuffer`, as returned by
+    `FrameBuffer.layer()`.
+
+    A `Layer` has all the drawing functions of the `FrameBuffer`.  Its pixels
+    start out transparent, and `erase()` makes them transparent again.  When
+    the `FrameBuffer` is shown, its layers are composited over it in order of
+    their depth, `z`.
+    '''
+    def __init__(self, width, height, z):
+        self._width, self._height = width, height
+        self.z = z
+        self.fb = bytearray(b'\xff') * (width * height)
+        self._composited = None
+
+    def _framebuffer(self):
+        return [[-1 if color == 0xFF else color for color in column]
+            for column in super()._framebuffer()]
+
+    def erase(self, color=-1):
+        '''Erase all pixels in the layer, making them transparent.
 
-class FrameBuffer(object):
+        `color`, if given, can fill the layer with a specific color.
+        '''
+        super().erase(color)
+
+def _over(below, above):
+    '''Returns `above` composited over `below` (equal length bytes, with 0xFF
+    transparent in `above`), with the pixels as big integers.
+    '''
+    keep = int.from_bytes(above.translate(_TRANSPARENT), 'big')
+    opaque = int.from_bytes(above.translate(_NOT_TRANSPARENT), 'big')
+    return ((int.from_bytes(below, 'big') & keep)
+        | (int.from_bytes(above, 'big') & opaque)).to_bytes(len(below), 'big')
+
+class FrameBuffer(_Canvas):
     ''' A framebuffer that maps to a chain of LED Matrix RaspberrySTEM Cells.  
     
     The LED Matrices are connected over the SPI bus.  The `FrameBuffer` object
@@ -289,7 +1594,7 @@ class FrameBuffer(object):
     15 is the highest brightness.
     '''
 
-    def __init__(self, matrix_layout=None, spi_port=0):
+    def __init__(self, matrix_layout=None, spi_port=0, asynchronous=False, backend=None):
         ''' Initialize the `rstem.led_matrix.FrameBuffer`.  
         
         If `matrix_layout` is not given (the default), then the LED Matrix
@@ -339,9 +1644,30 @@ class FrameBuffer(object):
         (however, not all of the framebuffer data will necessarily be displayed).
 
         The `spi_port` defines which SPI CE is used: 0 for CE0, 1 for CE1.
+
+        If `asynchronous` is True, `show()` does not wait for the framebuffer
+        to be sent to the LED Matrices.  Instead, it hands a copy of the
+        framebuffer to a background thread and returns immediately, so drawing
+        of the next frame can start while the current one is being sent.  If
+        `show()` is called again before the background thread gets to the
+        previous frame, the previous frame is dropped.  Use `wait_shown()` to
+        wait for the last shown frame to be sent, and `close()` to stop the
+        background thread.
+
+        `backend` selects where the framebuffer is sent.  By default, it is
+        sent to the LED Matrices over SPI (backend 'spi').  For testing and
+        benchmarking without LED Matrices, these backends are also available:
+
+            'null'              Discards the framebuffer
+            'file:<path>'       Appends the raw SPI bitstream to a file (or pipe)
+            'loopback:<N>'      Simulates a chain of N LED Matrices, with MISO
+                                hooked up (so `detect()` works)
+
+        If `backend` is not given, the RSTEM_LED_BACKEND environment variable
+        is used, if it is set.
         '''
         if not matrix_layout:
-            num_matrices = self.detect(spi_port)
+            num_matrices = self.detect(spi_port, backend)
             if num_matrices == 0:
                 raise IOError('No LED Matrices connected')
             elif num_matrices > 8:
@@ -370,128 +1696,410 @@ class FrameBuffer(object):
             [(x, y, _quarter_clockwise_rotations(angle)) for x, y, angle in matrix_layout]
 
         self.matrix_layout = matrix_layout
-        self.fb = [[0]*(maxy + 8) for i in range(maxx + 8)]
-        led_driver.init_spi(SPI_SPEED, spi_port)
 
-    def _framebuffer(self):
-        return self.fb
+        # The framebuffer is one contiguous byte per pixel, stored column-major
+        # so that pixel (x, y) is at offset x*height + y (equivalent to the
+        # fb[x][y] indexing of a list of columns).
+        self._width, self._height = maxx + 8, maxy + 8
+        self.fb = bytearray(self._width * self._height)
+        self._compile_layout()
+        self._layers = []
+        self._composites = []
+        self._composited = None
+        self._last_frame = None
+        self.sent_frames = 0
+        self.skipped_frames = 0
+        self._lut = None
+        self._matrix_luts = [None] * len(matrix_layout)
+        self._send_lut = None
+        self._dithering = False
+        led_driver.init_spi(_spi_speed(spi_port), spi_port, backend)
+
+        self._show_thread = None
+        if asynchronous:
+            # Double buffered: show() copies the framebuffer into the back
+            # buffer, and the show thread swaps it with its front buffer
+            # before sending.
+            self._back = bytearray(len(self.fb))
+            self._show_cond = Condition()
+            self._frames_shown = 0
+            self._frames_sent = 0
+            self._frames_dropped = 0
+            self._show_error = None
+            # The show thread only holds a weak reference to the FrameBuffer,
+            # so that it can be garbage collected without close(), which
+            # then stops the thread.
+            stopped = Event()
+            self._show_stopper = weakref.finalize(
+                self, FrameBuffer._stop_show_thread, self._show_cond, stopped)
+            self._show_thread = Thread(target=FrameBuffer._show_loop,
+                args=(weakref.ref(self), self._show_cond, stopped))
+            self._show_thread.daemon = True
+            self._show_thread.start()
 
-    def point(self, x, y=None, color=0xF):
-        ''' Draw point (`x`, `y`) in the framebuffer, using the given `color`.
+    @staticmethod
+    def _stop_show_thread(cond, stopped):
+        with cond:
+            stopped.set()
+            cond.notify_all()
 
-        For convenience, this function accepts a 2-tuple point as `x` if `y` is
-        None.  So, for example, both of the following are allowed:
+    @staticmethod
+    def _show_loop(fb_ref, cond, stopped):
+        front = None
+        frames_sent = 0
+        while True:
+            with cond:
+                while True:
+                    fb = fb_ref()
+                    if fb is None or stopped.is_set():
+                        return
+                    if fb._frames_shown != frames_sent:
+                        break
+                    # Dropping the last reference here runs the finalizer in
+                    # this thread, which sets stopped (without a waiter to
+                    # notify), so check it again before waiting.
+                    fb = None
+                    if stopped.is_set():
+                        return
+                    cond.wait()
+                if front is None:
+                    front = bytearray(len(fb._back))
+                front, fb._back = fb._back, front
+                gather, lut = fb._gather, fb._send_lut
+                fb._frames_dropped += fb._frames_shown - frames_sent - 1
+                frames_sent = fb._frames_shown
+                fb = None
+
+            # led_driver releases the GIL while the bitstream is sent.
+            try:
+                led_driver.send_fb(front, gather, lut)
+                error = None
+            except Exception as e:
+                error = e
+
+            with cond:
+                fb = fb_ref()
+                if fb is None or stopped.is_set():
+                    return
+                fb._frames_sent = frames_sent
+                if error:
+                    fb._show_error = error
+                    fb._last_frame = None
+                fb = None
+                cond.notify_all()
+
+    def close(self):
+        '''Stops the background thread of an asynchronous `FrameBuffer`,
+        after it has sent the last shown frame, and stops any dithering (see
+        `start_dithering()`).
+
+        A `FrameBuffer` can also be used as a context manager, which closes
+        it on exit.  `show()` must not be called after `close()`.
+        '''
+        self.stop_dithering()
+        if self._show_thread:
+            try:
+                self.wait_shown()
+            finally:
+                self._show_stopper()
+                self._show_thread.join()
+                self._show_thread = None
+
+    def __enter__(self):
+        return self
 
-            fb.point(2,3)
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        or
+    def _raise_show_error(self):
+        error, self._show_error = self._show_error, None
+        if error:
+            raise error
 
-            fb.point((2,3))
+    def _compile_layout(self):
+        '''Compiles the matrix layout into a gather map.
 
-        The point is drawn in the given `color`.
+        The gather map is the framebuffer offset of each pixel, in the order
+        the pixels are shifted out over SPI (last matrix in the chain first).
+        Each SPI byte holds two pixels: the even entries of the map are the
+        low nibbles, and the odd entries are the high nibbles.
         '''
-        try:
-            if y == None:
-                x, y = x
-            if x < 0 or y < 0:
-                raise IndexError
-            if color >= 0:
-                self.fb[x][y] = color
-        except IndexError:
-            pass
-
-    def erase(self, color=0):
-        '''Erase all pixels in the framebuffer
-
-        `color`, if given, can fill the framebuffer with a specific color.
+        height = self._height
+        forward = range(8)
+        backward = list(reversed(forward))
+        gather = []
+        for xoff, yoff, quarter_clockwise_rotations in reversed(self.matrix_layout):
+            if quarter_clockwise_rotations == 0:
+                coords = [(x, y) for x in forward for y in forward]
+            elif quarter_clockwise_rotations == 1:
+                coords = [(x, y) for y in backward for x in forward]
+            elif quarter_clockwise_rotations == 2:
+                coords = [(x, y) for x in backward for y in backward]
+            elif quarter_clockwise_rotations == 3:
+                coords = [(x, y) for y in forward for x in backward]
+            else:
+                raise RuntimeException('Internal Error: Invalid rotation')
+            gather += [(xoff + x)*height + yoff + y for x, y in coords]
+        self._gather = array('I', gather)
+
+    def layer(self, z=1):
+        '''Returns the `Layer` at depth `z`, creating it if needed.
+
+        Layers are composited over the framebuffer when it is shown, from the
+        lowest `z` to the highest.  For example, draw the static background
+        once into one layer, and erase and redraw the moving sprites each frame
+        in a layer above it:
+
+            background = fb.layer(1)
+            background.draw(walls)
+            sprites = fb.layer(2)
+            while True:
+                sprites.erase()
+                sprites.draw(player, position)
+                fb.show()
+
+        `show()` keeps the composite of each layer (with everything below it),
+        and only composites again from the lowest layer that has changed, so
+        layers that don't change cost only a comparison per frame.
         '''
-        for x in range(self.width):
-            for y in range(self.height):
-                self.fb[x][y] = color
-
-    def line(self, point_a, point_b, color=0xF):
-        '''Draw a line in the framebuffer from `point_a` to `point_b`.
+        for layer in self._layers:
+            if layer.z == z:
+                return layer
+        layer = Layer(self._width, self._height, z)
+        self._layers.append(layer)
+        self._layers.sort(key=lambda layer: layer.z)
+        self._composites = []
+        return layer
+
+    def remove_layer(self, z):
+        '''Removes the `Layer` at depth `z`.
+        '''
+        self._layers = [layer for layer in self._layers if layer.z != z]
+        self._composites = []
 
-        The line is drawn with the given `color`.
+    def _composite(self):
+        '''Returns the framebuffer with its layers composited over it.
         '''
-        # Uses Bresenham's Line Algorithm
-        # http://en.wikipedia.org/wiki/Bresenham's_line_algorithm
-        x1, y1 = point_a
-        x2, y2 = point_b
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        sx = 1 if x1 < x2 else -1
-        sy = 1 if y1 < y2 else -1
-        err = dx - dy
-        while True:
-            self.point(x1, y1, color)
-            if (x1 == x2 and y1 == y2) or x1 >= self.width or y1 >= self.height:
-                break
-            e2 = 2*err
-            if e2 > -dy:
-                err -= dy
-                x1 += sx
-            if e2 < dx:
-                err += dx
-                y1 += sy
+        if not self._layers:
+            return self.fb
+
+        # _composites[i] is the composite of the framebuffer and the layers
+        # below and including layer i - 1, as of the last show().
+        composites = self._composites
+        composite = None
+        changed = False
+        for i, canvas in enumerate([self] + self._layers):
+            if changed or i >= len(composites) or canvas.dirty:
+                changed = True
+                canvas._composited = bytes(canvas.fb)
+                if composite is None:
+                    composite = canvas._composited
+                else:
+                    composite = _over(composite, canvas._composited)
+                del composites[i:]
+                composites.append(composite)
+            else:
+                composite = composites[i]
+        return composite
 
-    def rect(self, origin, dimensions, fill=False, color=0xF):
-        '''Draws a rectangle in the framebuffer.
+    def set_lut(self, lut=None, matrix=None):
+        '''Sets a color lookup table, applied as the framebuffer is sent.
 
-        The `origin` is the lower left position of the rectangle.  The
-        `dimensions` is a 2-tuple of the width and height.  A width and height
-        of 1 would be a 1 point rectangle.
+        `lut` is a list of 16 colors: a pixel of color `c` is displayed as
+        color `lut[c]`.  If `lut` is None (the default), the colors are
+        displayed as they are.
 
-        If `fill` is True, then the interior of the rectanle will be filled.
-        Otherwise, only the outside edge of the rectandle will be drawn.  The
-        rectangle is drawn in the given `color`.
+        If `matrix` is None, the table applies to all the LED Matrices (for
+        example, to dim the display, see `set_brightness()`).  Otherwise it
+        applies only to the LED Matrix at that index in the `matrix_layout`,
+        after the table for all the matrices (for example, to match the
+        brightness of LED Matrices from different batches).
+
+        The lookup is done by the C extension as the framebuffer is packed
+        for sending, so costs nothing per pixel in Python.
         '''
-        x, y = origin
-        width, height = dimensions
+        if lut is not None:
+            lut = bytes(lut)
+            if len(lut) != 16 or max(lut) > 15:
+                raise ValueError('A LUT must be a list of 16 colors, each 0-15')
+            if lut == _IDENTITY_LUT:
+                lut = None
+        if matrix is None:
+            self._lut = lut
+        else:
+            self._matrix_luts[matrix] = lut
 
-        if fill:
-            for x_offset in range(width):
-                self.line((x + x_offset, y), (x + x_offset, y + height - 1), color)
+        # Compile the tables into what led_driver expects: one table, or one
+        # per matrix in the order they are sent.
+        if not any(self._matrix_luts):
+            self._send_lut = self._lut
         else:
-            self.line((x, y), (x, y + height - 1), color)
-            self.line((x, y + height - 1), (x + width - 1, y + height - 1), color)
-            self.line((x + width - 1, y + height - 1), (x + width - 1, y), color)
-            self.line((x + width - 1, y), (x, y), color)
-        
-    def show(self):
+            lut = self._lut or _IDENTITY_LUT
+            self._send_lut = b''.join(
+                bytes(matrix_lut[color] for color in lut) if matrix_lut else lut
+                for matrix_lut in reversed(self._matrix_luts))
+        # The display will change, even if the framebuffer doesn't
+        self._last_frame = None
+
+    def set_brightness(self, brightness=1.0, gamma=1.0):
+        '''Sets the lookup table for all LED Matrices (see `set_lut()`) to
+        scale colors by `brightness` (0.0 to 1.0), after gamma correcting them
+        by `gamma`.
+        '''
+        self.set_lut([min(15, int(round(15 * (color/15.0)**gamma * brightness)))
+            for color in range(16)])
+
+    def show(self, force=False):
         '''Send the framebuffer to the LED Matrices.
 
         Sends the current framebuffer to the LED Matrices over the SPI bus,
         according to the layout defined when the framebuffer was initialized.
         This will cause the framebuffer to be displayed on the LED Matrix(es).
+
+        If the `FrameBuffer` is asynchronous, the framebuffer is queued to be
+        sent in the background, and this function returns immediately.
+
+        Any layers (see `layer()`) are composited over the framebuffer first.
+
+        If dithering (see `start_dithering()`), the framebuffer is handed to
+        the dithering engine, which shows it from its next refresh.
+
+        If the framebuffer has not changed since it was last sent, nothing is
+        sent (the LED Matrices are already showing it), unless `force` is True
+        - for example, if the LED Matrices have been power cycled.  The
+        `sent_frames` and `skipped_frames` attributes count the frames sent
+        and the unchanged frames skipped.
         '''
-        bitstream = b''
-        for xoff, yoff, quarter_clockwise_rotations in reversed(self.matrix_layout):
-            forward = range(8)
-            backward = list(reversed(forward))
-            if quarter_clockwise_rotations == 0:
-                flat = [self.fb[xoff + x][yoff + y] for x in forward for y in forward]
-            elif quarter_clockwise_rotations == 1:
-                flat = [self.fb[xoff + x][yoff + y] for y in backward for x in forward]
-            elif quarter_clockwise_rotations == 2:
-                flat = [self.fb[xoff + x][yoff + y] for x in backward for y in backward]
-            elif quarter_clockwise_rotations == 3:
-                flat = [self.fb[xoff + x][yoff + y] for y in forward for x in backward]
-            else:
-                raise RuntimeException('Internal Error: Invalid rotation')
-            even = flat[::2]
-            odd = flat[1::2]
-            bitstream += bytes(b[0] | (b[1] << 4) for b in zip(even, odd))
-        led_driver.send(bitstream)
+        frame = self._composite()
+        if self._show_thread:
+            # An earlier frame that failed to send is raised here, rather
+            # than skipping its resend below.
+            with self._show_cond:
+                self._raise_show_error()
+        if not force and (frame is self._last_frame or frame == self._last_frame):
+            self.skipped_frames += 1
+            return
+
+        last_frame = frame if isinstance(frame, bytes) else bytes(frame)
+        if self._dithering:
+            led_driver.update_dither(frame, self._send_lut)
+            self._last_frame = last_frame
+        elif self._show_thread:
+            with self._show_cond:
+                self._raise_show_error()
+                self._back[:] = frame
+                self._frames_shown += 1
+                # Set under the lock, as the show thread clears it if the
+                # frame fails to send.
+                self._last_frame = last_frame
+                self._show_cond.notify_all()
+        else:
+            # The C extension does the gather via the layout's gather map,
+            # packs the pixels into nibbles, and sends the bitstream in one
+            # call.
+            led_driver.send_fb(frame, self._gather, self._send_lut)
+            self._last_frame = last_frame
+        self.sent_frames += 1
+
+    def start_dithering(self, refresh_hz=DITHER_REFRESH_HZ):
+        '''Starts refreshing the LED Matrices with temporal dithering, for
+        more levels of brightness than the 16 colors the LED Matrices have.
+
+        While dithering, each pixel of the framebuffer is a brightness level
+        from 0 (off) to 255 (the same as color 15), and `show()` hands the
+        framebuffer to a refresh engine in the C extension.  The engine sends
+        a frame `refresh_hz` times a second, from its own thread (so Python
+        code does not affect its timing), choosing each pixel's color in each
+        frame so that, averaged over successive frames, the pixel shows its
+        brightness level.  Any lookup table (see `set_lut()`) is applied to the
+        dithered colors.
+
+        Note that in layers (see `layer()`), level 255 is transparent, as
+        usual - use 254 for (almost) full brightness.
+
+        Use `stop_dithering()` to go back to showing colors 0-15 directly.
+        Dithering is also stopped by `close()`, or when the `FrameBuffer` is
+        garbage collected.  Only one `FrameBuffer` can be dithering at a time.
+        '''
+        self.stop_dithering()
+        led_driver.start_dither(self._gather, refresh_hz)
+        # The engine is stopped if this FrameBuffer is garbage collected
+        # without stop_dithering().
+        self._dither_stopper = weakref.finalize(self, led_driver.stop_dither)
+        self._dithering = True
+        self._last_frame = None
+
+    def stop_dithering(self):
+        '''Stops the dithering started by `start_dithering()`.
+
+        The LED Matrices keep showing the last dithered frame until the next
+        `show()`.
+        '''
+        if self._dithering:
+            self._dither_stopper()
+            self._dithering = False
+            self._last_frame = None
+
+    def dithering_stats(self):
+        '''Returns a dict of the dithering engine's `refreshes` (frames sent
+        since `start_dithering()`) and how many of them were `late` (sent
+        after the next refresh was due, because the SPI bus could not keep up
+        with the refresh rate).
+        '''
+        refreshes, late = led_driver.dither_stats()
+        return {'refreshes' : refreshes, 'late' : late}
+
+    def wait_shown(self, timeout=None):
+        '''Wait until the last `show()` has been sent to the LED Matrices.
+
+        Only useful for an asynchronous `FrameBuffer` - otherwise, `show()`
+        has already waited, and this function returns `True` immediately.
+
+        If `timeout=None` (the default), the function will block until the
+        frame has been sent.  If the `timeout` is a number 0 or greater, the
+        function will block for up to `timeout` time in seconds (floats
+        allowed), and return `False` if the frame still has not been sent.
+        Otherwise, returns `True`.
+        '''
+        if not self._show_thread:
+            return True
+        with self._show_cond:
+            frames_shown = self._frames_shown
+            sent = self._show_cond.wait_for(
+                lambda: self._frames_sent >= frames_shown, timeout)
+            self._raise_show_error()
+        return sent
+
+    def run(self, update, fps=30, frames=None):
+        '''Runs a frame loop, calling `update()` and then `show()` `fps` times a second.
+
+        `update` is a function (with no arguments) that updates and draws
+        the next frame.  The loop ends when `update` returns `False`, or
+        after `frames` frames if `frames` is given.  If `update` cannot keep
+        up with the frame rate, frames are skipped rather than letting the
+        loop fall further and further behind (see `FrameClock`).
+
+        Returns the `FrameClock` used to pace the loop, so its `stats()` can
+        be checked.
+        '''
+        clock = FrameClock(fps)
+        while frames is None or clock.frames < frames:
+            clock.wait()
+            if update() is False:
+                break
+            clock.rendered()
+            self.show()
+            clock.shown()
+        return clock
 
     @staticmethod
-    def detect(spi_port=0):
+    def detect(spi_port=0, backend=None):
         '''Returns the number of matrices connected.  
         
         Requires matrices connected in a full chain from MOSI back to MISO on
-        the Raspberry Pi.
+        the Raspberry Pi.  `backend` is as for the `FrameBuffer`.
         '''
-        led_driver.init_spi(SPI_SPEED, spi_port)
+        led_driver.init_spi(SPI_SPEED, spi_port, backend)
 
         # Matrix chain forms one long shift-register, of N * B, where N is the
         # number of matrices, and B is the length of the shift-register in each
@@ -499,54 +2107,82 @@ class FrameBuffer(object):
         #
         # If we assume there is some MAX number of matrices we won't exceed, we
         # can detect the length by push a string of bytes longer than the max
-        # through the chain.
-        rand = os.urandom(32)
-        sequence = rand + bytes(MAX_MATRICES * MATRIX_SPI_SHIFT_REGISTER_LENGTH)
-        recv = led_driver.send(sequence)
-
-        # Search the received bytes for the random sequence.  The offset
-        # determines the number of matrices in the chain
-        for i in range(MAX_MATRICES + 2):
-            start = i*MATRIX_SPI_SHIFT_REGISTER_LENGTH
-            end = start + MATRIX_SPI_SHIFT_REGISTER_LENGTH
-            if rand == recv[start:end]:
-                break
-        if i > MAX_MATRICES:
-            raise IOError('Could not determine length of LED Matrix chain.')
-        return i
-
-    @property
-    def width(self):
-        '''Returns the width of the framebuffer.
-
-        The width depends upon the matrix layout.
-        '''
-        return len(self.fb)
-
-    @property
-    def height(self):
-        '''Returns the height of the framebuffer.
-
-        The height depends upon the matrix layout.
-        '''
-        return len(self.fb[0])
-
-    def __str__(self):
-        return _color_array_to_str(self.fb, self.height, self.width)
-
-    def draw(self, drawable, origin=(0,0)):
-        '''Draw `drawable` into the framebuffer, at given origin.
+        # through the chain.  To keep detection of short chains quick, start
+        # by assuming a shorter chain, and double the length pushed until the
+        # chain length is found (or MAX_MATRICES is reached).
+        max_matrices = min(DETECT_MATRICES, MAX_MATRICES)
+        while True:
+            rand = os.urandom(MATRIX_SPI_SHIFT_REGISTER_LENGTH)
+            sequence = rand + bytes(max_matrices * MATRIX_SPI_SHIFT_REGISTER_LENGTH)
+            recv = led_driver.send(sequence)
+
+            # Search the received bytes for the random sequence.  The offset
+            # determines the number of matrices in the chain
+            for i in range(max_matrices + 1):
+                start = i*MATRIX_SPI_SHIFT_REGISTER_LENGTH
+                end = start + MATRIX_SPI_SHIFT_REGISTER_LENGTH
+                if rand == recv[start:end]:
+                    return i
+            if max_matrices >= MAX_MATRICES:
+                raise IOError('Could not determine length of LED Matrix chain.')
+            max_matrices = min(max_matrices * 2, MAX_MATRICES)
 
-        `drawable` is either a `Sprite` or `Text` object.
+    @staticmethod
+    def tune_spi_speed(spi_port=0, trials=10, save=True, backend=None):
+        '''Finds, and returns, the fastest SPI speed the LED Matrix chain can run at.
+
+        Like `detect()`, requires matrices connected in a full chain from MOSI
+        back to MISO on the Raspberry Pi.  Random patterns are pushed through
+        the chain, and the speed is binary searched (between `SPI_SPEED` and
+        `SPI_MAX_SPEED`) for the highest speed at which all `trials` patterns
+        come back intact.  The speed that works depends on the number of
+        matrices and the length of the cables between them.
+
+        If `save` is True (the default), the speed is saved for the given
+        `spi_port`, and is used by all `FrameBuffer`s created afterwards on
+        that port.  `backend` is as for the `FrameBuffer`.
         '''
-        xorig, yorig = origin
-        bitmap = drawable._bitmap()
-        if not bitmap:
-            return
-        width, height = len(bitmap), len(bitmap[0])
-        for x in range(width):
-            for y in range(height):
-                self.point(xorig + x, yorig + y, bitmap[x][y])
+        num_matrices = FrameBuffer.detect(spi_port, backend)
+        if num_matrices == 0:
+            raise IOError('No LED Matrices connected')
+
+        # The chain delays what is sent on MOSI by its length, so the pattern
+        # shows up on MISO that many bytes later.
+        delay = num_matrices * MATRIX_SPI_SHIFT_REGISTER_LENGTH
+        pattern_length = TUNE_PATTERN_MATRICES * MATRIX_SPI_SHIFT_REGISTER_LENGTH
+        def echoes(speed):
+            led_driver.init_spi(speed, spi_port, backend)
+            for trial in range(trials):
+                pattern = os.urandom(pattern_length)
+                recv = led_driver.send(pattern + bytes(delay))
+                if recv[delay:] != pattern:
+                    return False
+            return True
 
-__all__ = ['FrameBuffer', 'Sprite', 'Text']
+        try:
+            if echoes(SPI_MAX_SPEED):
+                speed = SPI_MAX_SPEED
+            else:
+                # Search until the speed is within TUNE_RESOLUTION of the
+                # fastest working speed.
+                good, bad = SPI_SPEED, SPI_MAX_SPEED
+                while bad - good > good * TUNE_RESOLUTION:
+                    speed = (good + bad) // 2
+                    if echoes(speed):
+                        good = speed
+                    else:
+                        bad = speed
+                speed = good
+        finally:
+            led_driver.init_spi(_spi_speed(spi_port), spi_port, backend)
+
+        if save:
+            speeds = _saved_spi_speeds()
+            speeds[str(spi_port)] = speed
+            with open(SPI_SPEEDS_FILE, 'w') as f:
+                json.dump(speeds, f)
+            led_driver.init_spi(speed, spi_port, backend)
+        return speed
+
+__all__ = ['Animation', 'FrameBuffer', 'FrameClock', 'Layer', 'ScrollingText', 'Sprite', 'SpriteSheet', 'SpriteView', 'Text']
         
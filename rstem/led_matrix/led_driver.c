@@ -20,26 +20,67 @@
  */
 
 
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <errno.h>
 #include <fcntl.h>
+#include <pthread.h>
+#include <time.h>
 #include <sys/ioctl.h>
 #include <linux/spi/spidev.h>
 
-#define MAX_MATRICES 50
+/*
+ * Maximum chain length supported by FrameBuffer.detect().  Exported to Python
+ * as led_driver.MAX_MATRICES.
+ */
+#define MAX_MATRICES 512
+
+/* Number of entries in a color lookup table (one per 4-bit color) */
+#define LUT_SIZE 16
+
+/*
+ * Long bitstreams are split into segments of at most SPI_SEGMENT_LEN bytes,
+ * with up to SPI_MAX_SEGMENTS segments submitted per SPI_IOC_MESSAGE.  spidev
+ * also limits the total length of one message to its bufsiz module parameter
+ * (4096 bytes by default), so a bitstream longer than that is sent as several
+ * messages, with chip select held asserted between them.
+ */
+#define SPI_SEGMENT_LEN 4096
+#define SPI_MAX_SEGMENTS 64
+#define SPIDEV_BUFSIZ_PATH "/sys/module/spidev/parameters/bufsiz"
+#define SPIDEV_DEFAULT_BUFSIZ 4096
+
+#define BACKEND_ENV "RSTEM_LED_BACKEND"
+#define DEFAULT_BACKEND "spi"
 
-int spi;
+int spi = -1;
 unsigned char spi_mode;
 unsigned char bits_per_trans;
 unsigned int spi_speed;
+size_t spi_bufsiz = SPIDEV_DEFAULT_BUFSIZ;
 
 
 // SPI  =============================================
 
+size_t read_spidev_bufsiz(void){
+    FILE *f;
+    unsigned long bufsiz;
+    f = fopen(SPIDEV_BUFSIZ_PATH, "r");
+    if (!f)
+        return SPIDEV_DEFAULT_BUFSIZ;
+    if (fscanf(f, "%lu", &bufsiz) != 1 || bufsiz == 0)
+        bufsiz = SPIDEV_DEFAULT_BUFSIZ;
+    fclose(f);
+    return bufsiz;
+}
+
 int start_spi(unsigned long speed, int mode){
     char *sMode;
-    if (spi) {
+    if (spi >= 0) {
         close(spi);
     }
     if(mode == 0){
@@ -51,6 +92,7 @@ int start_spi(unsigned long speed, int mode){
     spi_mode = SPI_MODE_0;
     bits_per_trans = 8;
     spi_speed = speed;
+    spi_bufsiz = read_spidev_bufsiz();
     spi = open(sMode, O_RDWR);
 
     err = ioctl(spi, SPI_IOC_WR_MODE, &spi_mode);
@@ -66,57 +108,696 @@ int start_spi(unsigned long speed, int mode){
     if (err < 0) goto out;
 
 out:
-    if (err < 0 && spi > 0)
+    if (err < 0 && spi >= 0) {
         close(spi);
+        spi = -1;
+    }
     return spi;
 }
 
-int rw_bytes(int dev, char * val, char * buff, int len){
-    struct spi_ioc_transfer tr = {
-        .tx_buf = (unsigned long)val,
-        .rx_buf = (unsigned long)buff,
-        .len = len
-    };
-    int ret = ioctl(dev, SPI_IOC_MESSAGE(1), &tr);
+int rw_bytes(int dev, const void * val, void * buff, size_t len){
+    struct spi_ioc_transfer tr[SPI_MAX_SEGMENTS];
+    const unsigned char *tx = val;
+    unsigned char *rx = buff;
+    size_t msg_max, msg_len, msg_offset, seg_len, offset = 0;
+    int n, ret, total = 0;
+
+    msg_max = spi_bufsiz;
+    if (msg_max > SPI_MAX_SEGMENTS * SPI_SEGMENT_LEN)
+        msg_max = SPI_MAX_SEGMENTS * SPI_SEGMENT_LEN;
+
+    do {
+        msg_len = len - offset < msg_max ? len - offset : msg_max;
+        memset(tr, 0, sizeof(tr));
+        n = 0;
+        msg_offset = 0;
+        do {
+            seg_len = msg_len - msg_offset;
+            if (seg_len > SPI_SEGMENT_LEN)
+                seg_len = SPI_SEGMENT_LEN;
+            tr[n].tx_buf = (unsigned long)(tx + offset);
+            tr[n].rx_buf = rx ? (unsigned long)(rx + offset) : 0;
+            tr[n].len = seg_len;
+            offset += seg_len;
+            msg_offset += seg_len;
+            n++;
+        } while (msg_offset < msg_len);
+
+        // Segments within a message never toggle chip select.  If more
+        // messages follow, keep chip select asserted after the last segment,
+        // so the chain sees one continuous bitstream.
+        if (offset < len)
+            tr[n - 1].cs_change = 1;
+
+        ret = ioctl(dev, SPI_IOC_MESSAGE(n), tr);
+        if (ret < 0)
+            return ret;
+        total += ret;
+    } while (offset < len);
+    return total;
+}
+
+// Backends =======================================
+
+/*
+ * Bitstreams are sent to one of several backends, selected by name when the
+ * port is initialized:
+ *
+ *      spi             The LED Matrices, via /dev/spidev0.<port> (default)
+ *      null            Discards the bitstream, and receives zeros
+ *      file:<path>     Appends the bitstream to a file (or pipe), and
+ *                      receives zeros
+ *      loopback:<N>    Simulates a chain of N LED Matrices with MISO hooked
+ *                      up: bytes are received N*32 bytes after they are sent
+ *
+ * If no backend name is given, the RSTEM_LED_BACKEND environment variable is
+ * used, if set.
+ */
+struct backend {
+    const char *name;
+    int (*open)(const char *arg, unsigned long speed, int port);
+    int (*xfer)(const void *tx, void *rx, size_t len);
+    void (*close)(void);
+};
+
+int spi_open(const char *arg, unsigned long speed, int port){
+    return start_spi(speed, port) < 0 ? -1 : 0;
+}
+
+int spi_xfer(const void *tx, void *rx, size_t len){
+    return rw_bytes(spi, tx, rx, len);
+}
+
+void spi_close(void){
+    if (spi >= 0)
+        close(spi);
+    spi = -1;
+}
+
+int null_open(const char *arg, unsigned long speed, int port){
+    return 0;
+}
+
+int null_xfer(const void *tx, void *rx, size_t len){
+    if (rx)
+        memset(rx, 0, len);
+    return len;
+}
+
+void null_close(void){
+}
+
+int sink = -1;
+
+int file_open(const char *arg, unsigned long speed, int port){
+    sink = open(arg, O_WRONLY | O_CREAT | O_APPEND, 0644);
+    return sink < 0 ? -1 : 0;
+}
+
+int file_xfer(const void *tx, void *rx, size_t len){
+    const char *buf = tx;
+    size_t written = 0;
+    ssize_t ret;
+    while (written < len) {
+        ret = write(sink, buf + written, len - written);
+        if (ret < 0) {
+            if (errno == EINTR)
+                continue;
+            return -1;
+        }
+        written += ret;
+    }
+    return null_xfer(tx, rx, len);
+}
+
+void file_close(void){
+    if (sink >= 0)
+        close(sink);
+    sink = -1;
+}
+
+unsigned char *chain;
+size_t chain_len;
+size_t chain_pos;
+
+int loopback_open(const char *arg, unsigned long speed, int port){
+    char *end;
+    unsigned long matrices = strtoul(arg, &end, 10);
+    if (end == arg || *end != '\0')
+        return -2;
+    chain_len = matrices * 32;
+    chain_pos = 0;
+    chain = calloc(chain_len ? chain_len : 1, 1);
+    return chain ? 0 : -1;
+}
+
+int loopback_xfer(const void *tx, void *rx, size_t len){
+    const unsigned char *in = tx;
+    unsigned char *out = rx;
+    unsigned char byte;
+    size_t i;
+    for (i = 0; i < len; i++) {
+        byte = in[i];
+        if (chain_len) {
+            // The chain is a shift register: the byte shifted out is the
+            // one shifted in chain_len bytes ago.
+            if (out)
+                out[i] = chain[chain_pos];
+            chain[chain_pos] = byte;
+            chain_pos = (chain_pos + 1) % chain_len;
+        } else if (out) {
+            out[i] = byte;
+        }
+    }
+    return len;
+}
+
+void loopback_close(void){
+    free(chain);
+    chain = NULL;
+}
+
+struct backend backends[] = {
+    {"spi", spi_open, spi_xfer, spi_close},
+    {"null", null_open, null_xfer, null_close},
+    {"file", file_open, file_xfer, file_close},
+    {"loopback", loopback_open, loopback_xfer, loopback_close},
+    {NULL, NULL, NULL, NULL}  /* Sentinal */
+};
+
+struct backend *backend;
+
+/*
+ * Serializes use of the backend.  transfer() is called with the GIL released,
+ * so the backend can be in use by several threads at once.
+ */
+pthread_mutex_t backend_lock = PTHREAD_MUTEX_INITIALIZER;
+
+/*
+ * Closes the current backend, and opens the named one.  Returns -2 if the name
+ * (or its argument) is invalid, or -1 if the backend fails to open.
+ */
+int start_backend(const char *name, unsigned long speed, int port){
+    struct backend *b;
+    const char *arg;
+    size_t name_len;
+    int ret;
+
+    arg = strchr(name, ':');
+    name_len = arg ? (size_t)(arg - name) : strlen(name);
+    arg = arg ? arg + 1 : "";
+    for (b = backends; b->name; b++) {
+        if (strlen(b->name) == name_len && strncmp(b->name, name, name_len) == 0)
+            break;
+    }
+    if (!b->name)
+        return -2;
+
+    pthread_mutex_lock(&backend_lock);
+    if (backend)
+        backend->close();
+    backend = NULL;
+    ret = b->open(arg, speed, port);
+    if (ret == 0)
+        backend = b;
+    pthread_mutex_unlock(&backend_lock);
     return ret;
 }
 
+int transfer(const void *tx, void *rx, size_t len){
+    int ret = -1;
+    pthread_mutex_lock(&backend_lock);
+    if (backend)
+        ret = backend->xfer(tx, rx, len);
+    pthread_mutex_unlock(&backend_lock);
+    return ret;
+}
+
+// Framebuffer packing ==============================
+
+/*
+ * Gathers pixels from the framebuffer via the gather map, and packs them two
+ * per byte into bitstream.  Even entries of the gather map are the low
+ * nibbles, odd entries the high nibbles.  Returns -1 if any gather map offset
+ * is outside of the framebuffer.
+ *
+ * If lut is not NULL, each pixel's color is looked up in a LUT_SIZE entry
+ * table as it is packed.  The bitstream is split evenly between the tables:
+ * one table covers the whole bitstream, or, for example, one table per
+ * matrix covers each matrix's bytes of the bitstream.  len must be a multiple
+ * of tables.
+ */
+int pack_nibbles(unsigned char *bitstream, const unsigned char *fb,
+        Py_ssize_t fb_len, const unsigned int *gather, Py_ssize_t len,
+        const unsigned char *lut, Py_ssize_t tables){
+    Py_ssize_t i, end;
+    unsigned int low, high;
+    const unsigned char *table;
+    if (!lut) {
+        for (i = 0; i < len; i++) {
+            low = gather[2*i];
+            high = gather[2*i + 1];
+            if (low >= fb_len || high >= fb_len)
+                return -1;
+            bitstream[i] = (fb[low] & 0xF) | ((fb[high] & 0xF) << 4);
+        }
+        return 0;
+    }
+    for (i = 0, table = lut; i < len; table += LUT_SIZE) {
+        for (end = i + len / tables; i < end; i++) {
+            low = gather[2*i];
+            high = gather[2*i + 1];
+            if (low >= fb_len || high >= fb_len)
+                return -1;
+            bitstream[i] = (table[fb[low] & 0xF] & 0xF) | ((table[fb[high] & 0xF] & 0xF) << 4);
+        }
+    }
+    return 0;
+}
+
+// Temporal dithering ==============================
+
+/*
+ * The dithering engine refreshes the LED Matrices from its own thread, at a
+ * fixed rate, from a framebuffer of 8-bit levels.  Each refresh quantizes
+ * every pixel to a 4-bit color with a first order sigma-delta modulator: the
+ * quantization error of each pixel is carried into its next refresh, so over
+ * successive refreshes each pixel averages to its 8-bit level.
+ *
+ * dither.lock protects the frame and LUT, which Python updates between
+ * refreshes.  The thread never calls into Python, so it runs without the GIL.
+ */
+struct dither {
+    pthread_t thread;
+    pthread_mutex_t lock;
+    int running;
+    int failed;
+    long period_ns;
+    Py_ssize_t len;             /* Bitstream length, in bytes */
+    unsigned int *gather;       /* 2*len framebuffer offsets */
+    Py_ssize_t fb_len;          /* Framebuffer length (max offset + 1) */
+    unsigned char *frame;       /* 8-bit levels, fb_len bytes */
+    unsigned short *error;      /* Carried error of each gathered pixel */
+    unsigned char lut[MAX_MATRICES * LUT_SIZE];
+    Py_ssize_t tables;          /* Number of LUTs (0 for none) */
+    unsigned char *bitstream;
+    unsigned long refreshes;
+    unsigned long late;
+};
+
+static struct dither dither = { .lock = PTHREAD_MUTEX_INITIALIZER };
+
+/* Quantizes a gathered pixel to 4 bits, carrying the error (in 255ths of a
+ * 4-bit step) to the next refresh. */
+static inline unsigned int dither_pixel(unsigned int i){
+    unsigned int level = dither.frame[dither.gather[i]] * 15 + dither.error[i];
+    unsigned int color = level / 255;
+    dither.error[i] = level - color * 255;
+    return color;
+}
+
+static void dither_pack(void){
+    Py_ssize_t i, end, per_table;
+    const unsigned char *table;
+    unsigned int low, high;
+    per_table = dither.tables ? dither.len / dither.tables : dither.len;
+    for (i = 0, table = dither.lut; i < dither.len; table += LUT_SIZE) {
+        for (end = i + per_table; i < end; i++) {
+            low = dither_pixel(2*i);
+            high = dither_pixel(2*i + 1);
+            if (dither.tables) {
+                low = table[low];
+                high = table[high];
+            }
+            dither.bitstream[i] = (low & 0xF) | ((high & 0xF) << 4);
+        }
+    }
+}
+
+static void timespec_add_ns(struct timespec *t, long ns){
+    t->tv_nsec += ns;
+    while (t->tv_nsec >= 1000000000L) {
+        t->tv_nsec -= 1000000000L;
+        t->tv_sec++;
+    }
+}
+
+static int timespec_before(const struct timespec *a, const struct timespec *b){
+    return a->tv_sec < b->tv_sec || (a->tv_sec == b->tv_sec && a->tv_nsec < b->tv_nsec);
+}
+
+static void *dither_thread(void *arg){
+    struct timespec next, now;
+    int running;
+    clock_gettime(CLOCK_MONOTONIC, &next);
+    while (1) {
+        pthread_mutex_lock(&dither.lock);
+        running = dither.running;
+        if (running)
+            dither_pack();
+        pthread_mutex_unlock(&dither.lock);
+        if (!running)
+            break;
+
+        if (transfer(dither.bitstream, NULL, dither.len) < 0) {
+            pthread_mutex_lock(&dither.lock);
+            dither.failed = 1;
+            dither.running = 0;
+            pthread_mutex_unlock(&dither.lock);
+            break;
+        }
+
+        // Refreshes are scheduled on a fixed period.  If one runs late, the
+        // schedule restarts from now rather than trying to catch up.
+        pthread_mutex_lock(&dither.lock);
+        dither.refreshes++;
+        timespec_add_ns(&next, dither.period_ns);
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        if (timespec_before(&next, &now)) {
+            dither.late++;
+            next = now;
+        }
+        pthread_mutex_unlock(&dither.lock);
+        while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &next, NULL) == EINTR)
+            ;
+    }
+    return NULL;
+}
+
+static void dither_free(void){
+    free(dither.gather);
+    free(dither.frame);
+    free(dither.error);
+    free(dither.bitstream);
+    dither.gather = NULL;
+    dither.frame = NULL;
+    dither.error = NULL;
+    dither.bitstream = NULL;
+}
+
+/* Stops the dithering thread, if it is running.  Call without the GIL. */
+static void stop_dither(void){
+    pthread_mutex_lock(&dither.lock);
+    dither.running = 0;
+    pthread_mutex_unlock(&dither.lock);
+    pthread_join(dither.thread, NULL);
+    dither_free();
+}
+
 // Python Wrappers =================================================
 
 
 static PyObject *py_init_spi(PyObject *self, PyObject *args){
-    unsigned int speed;
+    unsigned long speed;
     int mode;
+    const char *name = NULL;
     int ret;
-    if(!PyArg_ParseTuple(args, "ki", &speed, &mode)){
-        PyErr_SetString(PyExc_TypeError, "Not an unsigned long and int!");
+    if(!PyArg_ParseTuple(args, "ki|z", &speed, &mode, &name)){
         return NULL;
     }
-    ret = start_spi(speed, mode);
+    if (!name)
+        name = getenv(BACKEND_ENV);
+    if (!name || !*name)
+        name = DEFAULT_BACKEND;
+    Py_BEGIN_ALLOW_THREADS
+    ret = start_backend(name, speed, mode);
+    Py_END_ALLOW_THREADS
     if (ret < 0) {
-        PyErr_SetString(PyExc_IOError, "Failed to init SPI port.");
+        if (ret == -2)
+            PyErr_Format(PyExc_ValueError, "Invalid LED Matrix backend: %s", name);
+        else
+            PyErr_Format(PyExc_IOError, "Failed to init LED Matrix backend: %s", name);
         return NULL;
     }
     return Py_BuildValue("");
-}   
+}
 
-static PyObject *py_send(PyObject *self, PyObject *args){
-    char *s;
-    int len;
-    if(!PyArg_ParseTuple(args, "y#", &s, &len)){
-        PyErr_SetString(PyExc_TypeError, "Not an unsigned int!");
+/*
+ * send(tx[, rx])
+ *
+ * tx can be any bytes-like object.  If rx is not given, the received bytes
+ * are returned as a new bytes object.  If rx is a writable bytes-like object
+ * (at least as long as tx) the received bytes are written into it, and it is
+ * returned.  If rx is None, the bytes are only transmitted, and None is
+ * returned.
+ */
+static PyObject *py_send(PyObject *self, PyObject *args, PyObject *kwargs){
+    static char *kwlist[] = {"tx", "rx", NULL};
+    Py_buffer tx, rx;
+    PyObject *rx_obj = NULL;
+    PyObject *ret = NULL;
+    char *rx_buf = NULL;
+    int err;
+    if(!PyArg_ParseTupleAndKeywords(args, kwargs, "y*|O", kwlist, &tx, &rx_obj)){
         return NULL;
     }
-    if (rw_bytes(spi, s, s, len) < 0) {
+    rx.obj = NULL;
+    if (rx_obj == NULL) {
+        ret = PyBytes_FromStringAndSize(NULL, tx.len);
+        if (!ret)
+            goto out;
+        rx_buf = PyBytes_AS_STRING(ret);
+    } else if (rx_obj != Py_None) {
+        if (PyObject_GetBuffer(rx_obj, &rx, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS) < 0)
+            goto out;
+        if (rx.len < tx.len) {
+            PyErr_SetString(PyExc_ValueError, "rx buffer is shorter than tx buffer.");
+            goto out;
+        }
+        rx_buf = rx.buf;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    err = transfer(tx.buf, rx_buf, tx.len);
+    Py_END_ALLOW_THREADS
+    if (err < 0) {
         PyErr_SetString(PyExc_IOError, "Failed to read/write LED Matrices via SPI.");
+        Py_CLEAR(ret);
+        goto out;
+    }
+    if (rx_obj != NULL) {
+        ret = rx_obj;
+        Py_INCREF(ret);
+    }
+
+out:
+    if (rx.obj)
+        PyBuffer_Release(&rx);
+    PyBuffer_Release(&tx);
+    return ret;
+}
+
+static PyObject *py_send_fb(PyObject *self, PyObject *args){
+    Py_buffer fb, gather, lut = {0};
+    PyObject *gather_obj, *lut_obj = Py_None;
+    unsigned char *bitstream;
+    Py_ssize_t len, tables = 0;
+    int err;
+    if(!PyArg_ParseTuple(args, "y*O|O", &fb, &gather_obj, &lut_obj)){
+        return NULL;
+    }
+    if (PyObject_GetBuffer(gather_obj, &gather, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) {
+        PyBuffer_Release(&fb);
+        return NULL;
+    }
+    if (gather.itemsize != sizeof(unsigned int) || strcmp(gather.format, "I") != 0
+            || (gather.len / gather.itemsize) % 2 != 0) {
+        PyErr_SetString(PyExc_TypeError,
+            "Gather map must be an array('I') with an even number of offsets!");
+        goto fail;
+    }
+    len = gather.len / gather.itemsize / 2;
+    if (lut_obj != Py_None) {
+        if (PyObject_GetBuffer(lut_obj, &lut, PyBUF_SIMPLE) < 0)
+            goto fail;
+        tables = lut.len / LUT_SIZE;
+        if (tables == 0 || lut.len % LUT_SIZE != 0 || len % tables != 0) {
+            PyErr_SetString(PyExc_ValueError,
+                "LUT must be one or more 16 byte tables, evenly dividing the bitstream.");
+            goto fail;
+        }
+    }
+    bitstream = malloc(len ? len : 1);
+    if (!bitstream) {
+        PyErr_NoMemory();
+        goto fail;
+    }
+    if (pack_nibbles(bitstream, fb.buf, fb.len, gather.buf, len, lut.buf, tables) < 0) {
+        free(bitstream);
+        PyErr_SetString(PyExc_ValueError, "Gather map offset outside of framebuffer.");
+        goto fail;
+    }
+    // The bitstream is private to this call, so other Python threads can run
+    // while it is sent.
+    Py_BEGIN_ALLOW_THREADS
+    err = transfer(bitstream, NULL, len);
+    Py_END_ALLOW_THREADS
+    free(bitstream);
+    if (err < 0) {
+        PyErr_SetString(PyExc_IOError, "Failed to write LED Matrices via SPI.");
+        goto fail;
+    }
+    if (lut.obj)
+        PyBuffer_Release(&lut);
+    PyBuffer_Release(&gather);
+    PyBuffer_Release(&fb);
+    return Py_BuildValue("");
+
+fail:
+    if (lut.obj)
+        PyBuffer_Release(&lut);
+    PyBuffer_Release(&gather);
+    PyBuffer_Release(&fb);
+    return NULL;
+}
+
+static PyObject *py_start_dither(PyObject *self, PyObject *args){
+    Py_buffer gather;
+    PyObject *gather_obj;
+    double refresh_hz;
+    Py_ssize_t i, n;
+    unsigned int max_offset = 0;
+    const unsigned int *offsets;
+    int err;
+    if(!PyArg_ParseTuple(args, "Od", &gather_obj, &refresh_hz)){
+        return NULL;
+    }
+    if (refresh_hz <= 0) {
+        PyErr_SetString(PyExc_ValueError, "Refresh rate must be positive.");
+        return NULL;
+    }
+    if (dither.gather) {
+        PyErr_SetString(PyExc_RuntimeError, "Dithering is already started.");
+        return NULL;
+    }
+    if (PyObject_GetBuffer(gather_obj, &gather, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) {
+        return NULL;
+    }
+    if (gather.itemsize != sizeof(unsigned int) || strcmp(gather.format, "I") != 0
+            || (gather.len / gather.itemsize) % 2 != 0 || gather.len == 0) {
+        PyErr_SetString(PyExc_TypeError,
+            "Gather map must be a non-empty array('I') with an even number of offsets!");
+        PyBuffer_Release(&gather);
         return NULL;
     }
-    return Py_BuildValue("y#", s, len);
+    n = gather.len / gather.itemsize;
+    offsets = gather.buf;
+    for (i = 0; i < n; i++)
+        if (offsets[i] > max_offset)
+            max_offset = offsets[i];
+
+    dither.len = n / 2;
+    dither.fb_len = (Py_ssize_t) max_offset + 1;
+    dither.gather = malloc(gather.len);
+    dither.frame = calloc(dither.fb_len, 1);
+    dither.error = calloc(n, sizeof(*dither.error));
+    dither.bitstream = malloc(dither.len);
+    if (!dither.gather || !dither.frame || !dither.error || !dither.bitstream) {
+        dither_free();
+        PyBuffer_Release(&gather);
+        return PyErr_NoMemory();
+    }
+    memcpy(dither.gather, gather.buf, gather.len);
+    PyBuffer_Release(&gather);
+    dither.period_ns = (long) (1e9 / refresh_hz);
+    dither.tables = 0;
+    dither.refreshes = dither.late = 0;
+    dither.failed = 0;
+    dither.running = 1;
+    err = pthread_create(&dither.thread, NULL, dither_thread, NULL);
+    if (err) {
+        dither.running = 0;
+        dither_free();
+        errno = err;
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+    return Py_BuildValue("");
+}
+
+static PyObject *py_update_dither(PyObject *self, PyObject *args){
+    Py_buffer fb, lut = {0};
+    PyObject *lut_obj = Py_None, *ret = NULL;
+    Py_ssize_t tables = 0;
+    int failed;
+    if(!PyArg_ParseTuple(args, "y*|O", &fb, &lut_obj)){
+        return NULL;
+    }
+    if (!dither.gather) {
+        PyErr_SetString(PyExc_RuntimeError, "Dithering is not started.");
+        goto out;
+    }
+    if (fb.len < dither.fb_len) {
+        PyErr_SetString(PyExc_ValueError, "Framebuffer is smaller than the gather map.");
+        goto out;
+    }
+    if (lut_obj != Py_None) {
+        if (PyObject_GetBuffer(lut_obj, &lut, PyBUF_SIMPLE) < 0)
+            goto out;
+        tables = lut.len / LUT_SIZE;
+        if (tables == 0 || lut.len % LUT_SIZE != 0 || tables > MAX_MATRICES
+                || dither.len % tables != 0) {
+            PyErr_SetString(PyExc_ValueError,
+                "LUT must be one or more 16 byte tables, evenly dividing the bitstream.");
+            goto out;
+        }
+    }
+    Py_BEGIN_ALLOW_THREADS
+    pthread_mutex_lock(&dither.lock);
+    failed = dither.failed;
+    memcpy(dither.frame, fb.buf, dither.fb_len);
+    if (tables)
+        memcpy(dither.lut, lut.buf, lut.len);
+    dither.tables = tables;
+    pthread_mutex_unlock(&dither.lock);
+    Py_END_ALLOW_THREADS
+    if (failed) {
+        PyErr_SetString(PyExc_IOError, "Failed to write LED Matrices via SPI.");
+        goto out;
+    }
+    ret = Py_BuildValue("");
+
+out:
+    if (lut.obj)
+        PyBuffer_Release(&lut);
+    PyBuffer_Release(&fb);
+    return ret;
+}
+
+static PyObject *py_stop_dither(PyObject *self, PyObject *args){
+    if (dither.gather) {
+        Py_BEGIN_ALLOW_THREADS
+        stop_dither();
+        Py_END_ALLOW_THREADS
+    }
+    return Py_BuildValue("");
+}
+
+static PyObject *py_dither_stats(PyObject *self, PyObject *args){
+    unsigned long refreshes, late;
+    pthread_mutex_lock(&dither.lock);
+    refreshes = dither.refreshes;
+    late = dither.late;
+    pthread_mutex_unlock(&dither.lock);
+    return Py_BuildValue("kk", refreshes, late);
 }
 
 static PyMethodDef led_driver_methods[] = {
-    {"init_spi", py_init_spi, METH_VARARGS, "Initialize the SPI port."},
-    {"send", py_send, METH_VARARGS, "Sends bytes via SPI port."},
+    {"init_spi", py_init_spi, METH_VARARGS,
+        "Initialize the SPI port, optionally with a non-default backend."},
+    {"send", (PyCFunction)(void (*)(void)) py_send, METH_VARARGS | METH_KEYWORDS,
+        "Sends bytes via SPI port, and optionally receives bytes."},
+    {"send_fb", py_send_fb, METH_VARARGS,
+        "Gathers and packs a framebuffer via a gather map (optionally looking up\n"
+        "colors in lookup tables), and sends it via SPI port."},
+    {"start_dither", py_start_dither, METH_VARARGS,
+        "Starts refreshing the LED Matrices from a thread, via a gather map,\n"
+        "temporally dithering an 8-bit framebuffer to 4-bit colors."},
+    {"update_dither", py_update_dither, METH_VARARGS,
+        "Sets the 8-bit framebuffer (and optionally lookup tables) to dither."},
+    {"stop_dither", py_stop_dither, METH_NOARGS,
+        "Stops dithering."},
+    {"dither_stats", py_dither_stats, METH_NOARGS,
+        "Returns the number of dithered refreshes sent, and how many ran late."},
     {NULL, NULL, 0, NULL}  /* Sentinal */
 };
 
@@ -189,6 +870,11 @@ void initled_driver(void)
         INITERROR;
     }
 
+    if (PyModule_AddIntConstant(module, "MAX_MATRICES", MAX_MATRICES) < 0) {
+        Py_DECREF(module);
+        INITERROR;
+    }
+
 #if PY_MAJOR_VERSION >= 3
     return module;
 #endif
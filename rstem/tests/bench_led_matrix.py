@@ -0,0 +1,175 @@
+'''
+Micro-benchmarks for the LED Matrix API.
+
+Runs against the 'null' LED Matrix backend, so no LED Matrices (or SPI) are
+required, and the show() results measure only the CPU cost of sending a frame.
+
+Usage: python3 bench_led_matrix.py [-k NAME] [--save FILE] [--baseline FILE]
+
+Results are printed as a table, and can be saved as JSON with --save.  Given a
+--baseline (a JSON file from a previous --save), each result is compared
+against it, and the exit status is 1 if any benchmark is slower than the
+baseline by more than --tolerance.
+'''
+import argparse
+import copy
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from functools import partial
+from rstem.led_matrix import FrameBuffer, Sprite, Text
+
+BACKEND = 'null'
+MIN_TIME = 0.2
+LAYOUT_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+def layout(num_matrices):
+    # Matrices in rows of up to 8, as on a wall of matrices
+    return [((i % 8) * 8, (i // 8) * 8, 0) for i in range(num_matrices)]
+
+def framebuffer(num_matrices=1):
+    return FrameBuffer(matrix_layout=layout(num_matrices), backend=BACKEND)
+
+def sprite(width, height, color='5'):
+    return Sprite(((color * width) + '\n') * height)
+
+def measure(func, min_time=MIN_TIME):
+    '''Returns (operations per second, peak bytes allocated by one operation).
+    '''
+    # Find a number of loops that takes at least min_time
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+
+    tracemalloc.start()
+    before, peak = tracemalloc.get_traced_memory()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loops / elapsed, max(0, peak - before)
+
+def benchmarks():
+    '''Yields (name, function) for each benchmark.
+    '''
+    fb = framebuffer(8)
+    yield 'point', partial(fb.point, 3, 4)
+    yield 'line', partial(fb.line, (0, 0), (fb.width - 1, fb.height - 1))
+    yield 'line_offscreen', partial(fb.line, (-100, -50), (fb.width - 1, fb.height - 1))
+    yield 'rect', partial(fb.rect, (1, 1), (fb.width - 2, fb.height - 2))
+    yield 'rect_fill', partial(fb.rect, (0, 0), (fb.width, fb.height), fill=True)
+    yield 'circle_fill', partial(fb.circle, (fb.width // 2, fb.height // 2), 6, fill=True)
+    yield 'polygon_fill', partial(fb.polygon, [(0, 0), (fb.width - 1, 2), (10, fb.height - 1)], fill=True)
+    yield 'erase', fb.erase
+    frame = memoryview(bytes(range(16)) * (fb.width * fb.height // 16)).cast('B', (fb.width, fb.height))
+    yield 'blit_array', partial(fb.blit_array, frame)
+
+    s8 = sprite(8, 8)
+    s16 = sprite(16, 16)
+    transparent = Sprite('5-5-5-5-\n-5-5-5-5\n' * 4)
+    panorama = sprite(256, 16)
+    yield 'draw_sprite_8x8', partial(fb.draw, s8, (4, 4))
+    yield 'draw_sprite_16x16', partial(fb.draw, s16)
+    yield 'draw_sprite_transparent', partial(fb.draw, transparent, (4, 4))
+    yield 'draw_sprite_offscreen', partial(fb.draw, panorama, (-200, 0))
+
+    yield 'text_1', partial(Text, 'A')
+    yield 'text_10', partial(Text, '0123456789')
+
+    s = copy.deepcopy(s16)
+    yield 'sprite_rotate', partial(s.rotate, 90)
+    yield 'sprite_flip', s.flip
+    yield 'sprite_crop', lambda: s.reset().crop((2, 2), (8, 8))
+    yield 'sprite_view_draw', lambda: fb.draw(s16.view().rotate(90).flip().crop((2, 2), (8, 8)))
+
+    layered = framebuffer(8)
+    layered.layer(1).rect((0, 0), (layered.width, layered.height), fill=True, color=2)
+    sprites = layered.layer(2)
+    def show_layers():
+        sprites.erase()
+        sprites.draw(s8, (4, 4))
+        layered.show(force=True)
+    yield 'show_layers', show_layers
+
+    yield 'show_unchanged', framebuffer(8).show
+    dimmed = framebuffer(8)
+    dimmed.set_brightness(0.5, gamma=2.2)
+    yield 'show_8_lut', partial(dimmed.show, force=True)
+    for num_matrices in LAYOUT_SIZES:
+        yield 'show_{}'.format(num_matrices), partial(framebuffer(num_matrices).show, force=True)
+
+def run(selected=None):
+    results = {}
+    for name, func in benchmarks():
+        if selected and not any(k in name for k in selected):
+            continue
+        ops, alloc = measure(func)
+        results[name] = {
+            'ops_per_sec' : ops,
+            'usecs_per_op' : 1000000.0 / ops,
+            'peak_alloc_bytes' : alloc,
+            }
+    return results
+
+def compare(results, baseline, tolerance):
+    '''Prints a table of results (against the baseline, if given).  Returns
+    the names of benchmarks slower than the baseline by more than tolerance.
+    '''
+    regressions = []
+    print('{:28} {:>14} {:>12} {:>10} {:>10}'.format(
+        'benchmark', 'ops/s', 'usecs/op', 'alloc', 'vs base'))
+    for name, result in results.items():
+        versus = ''
+        base = baseline.get(name) if baseline else None
+        if base:
+            ratio = result['ops_per_sec'] / base['ops_per_sec']
+            versus = '{:.2f}x'.format(ratio)
+            if ratio < 1 - tolerance:
+                regressions.append(name)
+                versus += ' !'
+        print('{:28} {:14.1f} {:12.2f} {:10d} {:>10}'.format(
+            name, result['ops_per_sec'], result['usecs_per_op'],
+            result['peak_alloc_bytes'], versus))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='LED Matrix micro-benchmarks')
+    parser.add_argument('-k', action='append', metavar='NAME',
+        help='only run benchmarks whose name contains NAME (repeatable)')
+    parser.add_argument('--save', metavar='FILE', help='save results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against saved JSON results')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='allowed slowdown versus the baseline (default 0.1)')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = run(args.k)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python' : platform.python_version(),
+                'machine' : platform.machine(),
+                'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results' : results,
+                }, f, indent=4, sort_keys=True)
+
+    if regressions:
+        print('Slower than baseline: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,6 +3,9 @@ API tests for LED Matrix.
 
 The automatic tests require no LED matrix attached.  The manual tests require a
 single matrix rotated clockwise 90 degrees.
+
+The automatic tests can also be run without SPI hardware, by setting the
+environment variable RSTEM_LED_BACKEND=null.
 '''
 
 '''
@@ -18,8 +21,13 @@ single matrix rotated clockwise 90 degrees.
 import testing
 import time
 from functools import partial
-from rstem.led_matrix import FrameBuffer, Sprite, Text
+from rstem import led_matrix
+from rstem.led_matrix import FrameBuffer, Sprite, Text, led_driver
 import copy
+import os
+import sys
+import tempfile
+import weakref
 
 def makefb(lines):
     # Remove whitespace from lines
@@ -250,6 +258,15 @@ def out_of_bounds_point4():
     fb.point(0, fb.height)
     return fb._framebuffer() == erased_fb()
 
+@testing.automatic
+def point_framebuffer_indexing():
+    fb = FrameBuffer(matrix_layout=[(0,0,0), (8,8,0)])
+    fb.point(15,1,color=1)
+    fb.point(1,15,color=2)
+    framebuffer = fb._framebuffer()
+    return framebuffer[15][1] == 1 and framebuffer[1][15] == 2 \
+        and fb.fb[15*fb.height + 1] == 1 and fb.fb[1*fb.height + 15] == 2
+
 @testing.automatic
 def time_point():
     fb = FrameBuffer(matrix_layout=[(0,0,0)])
@@ -342,6 +359,23 @@ def line5():
         '''
     return arrays_equal(expected_fb, fb)
 
+@testing.automatic
+def line_clipped():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.line((20,1),(-5,6))
+    fb.line((-9,-1),(-1,30))
+    expected_fb = '''
+        00000000
+        00000000
+        FFF00000
+        000FFFFF
+        00000000
+        00000000
+        00000000
+        00000000
+        '''
+    return arrays_equal(expected_fb, fb)
+
 
 #########################################################################
 # rect() tests
@@ -414,6 +448,82 @@ def rect4():
         '''
     return arrays_equal(expected_fb, fb)
 
+#########################################################################
+# circle(), ellipse() and polygon() tests
+#
+
+@testing.automatic
+def circle1():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.circle((3,3),3, color=1)
+    fb.circle((6,6),2, fill=True, color=2)
+    # A negative color draws nothing
+    fb.circle((3,3),2, fill=True, color=-1)
+    fb.ellipse((3,3),(2,1), fill=True, color=-1)
+    expected_fb = '''
+        00002222
+        00112222
+        01002222
+        10000222
+        10000010
+        10000010
+        01000100
+        00111000
+        '''
+    return arrays_equal(expected_fb, fb)
+
+@testing.automatic
+def triangle_fill():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.triangle((0,0),(7,0),(0,7), fill=True, color=3)
+    fb.ellipse((5,5),(2,1), color=4)
+    expected_fb = '''
+        30000000
+        33004440
+        33340004
+        33334440
+        33333000
+        33333300
+        33333330
+        33333333
+        '''
+    return arrays_equal(expected_fb, fb)
+
+#########################################################################
+# Layer tests
+#
+
+@testing.automatic
+def layers():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.erase(1)
+    top = fb.layer(3)
+    top.rect((2,2),(4,4), color=3)
+    background = fb.layer(2)
+    background.rect((0,0),(8,4), fill=True, color=2)
+    fb.show()
+    first_composites = list(fb._composites)
+
+    # Only the top layer changed, so the composites below it are reused.
+    top.erase()
+    top.point(7,7, color=0xF)
+    fb.show()
+    reused = fb._composites[:2] == first_composites[:2] and fb._composites[1] is first_composites[1]
+    composited = FrameBuffer(matrix_layout=[(0,0,0)])
+    composited.fb[:] = fb._composite()
+    expected_fb = '''
+        1111111F
+        11111111
+        11111111
+        11111111
+        22222222
+        22222222
+        22222222
+        22222222
+        '''
+    return (reused and arrays_equal(expected_fb, composited)
+        and not top.dirty and str(top).startswith('-------F\n'))
+
 #########################################################################
 # misc tests
 #
@@ -427,10 +537,200 @@ def detect_fail():
         return True
     return False
 
+@testing.automatic
+def show_gather_map():
+    # The last matrix in the chain is shifted out first.  A 90 degree matrix
+    # starts at its upper left pixel.
+    fb = FrameBuffer(matrix_layout=[(0,0,90), (8,0,0)])
+    return len(fb._gather) == 128 and fb._gather[0] == 8*fb.height \
+        and fb._gather[64] == 7
+
+@testing.automatic
+def show_asynchronous():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)], asynchronous=True)
+    for i in range(16):
+        fb.erase(i)
+        fb.show()
+    return fb.wait_shown(timeout=1) and fb._frames_sent == 16
+
+@testing.automatic
+def show_thread_stops():
+    with FrameBuffer(matrix_layout=[(0,0,0)], asynchronous=True) as fb:
+        fb.show()
+        closed_thread = fb._show_thread
+    if closed_thread.is_alive() or fb._frames_sent != 1:
+        return False
+
+    # Dropping an unclosed asynchronous FrameBuffer stops its thread, too
+    fb = FrameBuffer(matrix_layout=[(0,0,0)], asynchronous=True)
+    fb.show()
+    fb.wait_shown()
+    dropped_thread, fb_ref = fb._show_thread, weakref.ref(fb)
+    del fb
+    dropped_thread.join(timeout=1)
+    if fb_ref() is not None or dropped_thread.is_alive():
+        return False
+
+    # Switching threads as often as possible, the FrameBuffer is sometimes
+    # dropped while its thread holds the last reference.
+    threads = []
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for i in range(3000):
+            fb = FrameBuffer(matrix_layout=[(0,0,0)], asynchronous=True)
+            threads.append(fb._show_thread)
+            del fb
+    finally:
+        sys.setswitchinterval(switch_interval)
+    for thread in threads:
+        thread.join(timeout=1)
+    return not any(thread.is_alive() for thread in threads)
+
+@testing.automatic
+def send_buffers():
+    FrameBuffer(matrix_layout=[(0,0,0)])
+    tx = bytearray(32)
+    rx = bytearray(32)
+    return led_driver.send(tx, rx) is rx and led_driver.send(tx, None) is None \
+        and len(led_driver.send(memoryview(tx))) == 32
+
+@testing.automatic
+def run_frames():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    start = time.monotonic()
+    clock = fb.run(lambda: fb.erase(), fps=50, frames=25)
+    elapsed = time.monotonic() - start
+    stats = clock.stats()
+    print(stats)
+    # The frames can't start early, but a loaded machine (e.g. a Pi Zero) can
+    # start them late, so only the lower bound on time is exact.
+    return (clock.frames == 25 and elapsed >= 24 * clock.period
+        and stats['skipped'] <= 5 and stats['missed'] <= 12)
+
+@testing.automatic
+def detect_loopback():
+    return FrameBuffer.detect(backend='loopback:5') == 5 \
+        and FrameBuffer.detect(backend='loopback:100') == 100
+
+@testing.automatic
+def show_file_backend():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bitstream')
+        fb = FrameBuffer(matrix_layout=[(0,0,0), (8,0,0)], backend='file:' + path)
+        fb.erase(0xA)
+        fb.point(0,0,1)
+        fb.show()
+        with open(path, 'rb') as f:
+            bitstream = f.read()
+    # The second matrix is sent first, and (0,0) is the first pixel of the
+    # first matrix
+    return bitstream == b'\xaa' * 32 + b'\xa1' + b'\xaa' * 31
+
+@testing.automatic
+def show_unchanged_skipped():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bitstream')
+        fb = FrameBuffer(matrix_layout=[(0,0,0)], backend='file:' + path)
+        fb.erase(0xA)
+        fb.show()
+        fb.show()
+        fb.point(0,0,1)
+        fb.show()
+        fb.show(force=True)
+        fb.layer().erase()
+        fb.show()
+        with open(path, 'rb') as f:
+            frames = len(f.read()) // 32
+    return frames == 3 and fb.sent_frames == 3 and fb.skipped_frames == 2
+
+@testing.automatic
+def show_unchanged_after_error():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)], asynchronous=True, backend='file:/dev/full')
+    fb.show()
+    timeout = time.time() + 1
+    while fb._frames_sent < 1 and time.time() < timeout:
+        time.sleep(0.01)
+    # The failed send is raised by the next show(), and the unchanged frame
+    # is sent again rather than skipped.
+    try:
+        fb.show()
+        return False
+    except IOError:
+        pass
+    try:
+        fb.show()
+        fb.wait_shown()
+        return False
+    except IOError:
+        pass
+    return fb.sent_frames == 2 and fb.skipped_frames == 0
+
+@testing.automatic
+def show_lut():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bitstream')
+        fb = FrameBuffer(matrix_layout=[(0,0,0), (8,0,0)], backend='file:' + path)
+        fb.erase(0xA)
+        fb.point(0,0,1)
+        fb.set_lut([15 - color for color in range(16)])
+        fb.set_lut([color // 2 for color in range(16)], matrix=1)
+        fb.show()
+        # Changing the LUT sends the unchanged framebuffer again
+        fb.set_brightness(0)
+        fb.show()
+        with open(path, 'rb') as f:
+            bitstream = f.read()
+    # The second matrix is sent first (0xA -> 0x5 -> 0x2), then the first
+    # (0xA -> 0x5, 0x1 -> 0xE)
+    return bitstream == b'\x22' * 32 + b'\x5e' + b'\x55' * 31 + b'\x00' * 64
+
+@testing.automatic
+def show_dithered():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bitstream')
+        fb = FrameBuffer(matrix_layout=[(0,0,0)], backend='file:' + path)
+        fb.start_dithering(refresh_hz=2000)
+        fb.erase(128)
+        fb.show()
+        if str(fb) != ('80' * 8 + '\n') * 8:
+            return False
+        timeout = time.time() + 5
+        while fb.dithering_stats()['refreshes'] < 600 and time.time() < timeout:
+            time.sleep(0.01)
+        fb.stop_dithering()
+        with open(path, 'rb') as f:
+            bitstream = f.read()
+    frames = [bitstream[i:i + 32] for i in range(0, len(bitstream), 32)]
+    if len(frames) < 600:
+        return False
+    # Over any 255 refreshes, each pixel's colors add up to exactly 128/255ths
+    # of 255 refreshes of color 15.
+    sums = [sum(frame[i] & 0xF for frame in frames[-255:]) for i in range(32)]
+    sums += [sum(frame[i] >> 4 for frame in frames[-255:]) for i in range(32)]
+    if sums != [128 * 15] * 64 or fb._dithering:
+        return False
+
+    # Dropping a dithering FrameBuffer stops the engine, so another can start
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.start_dithering()
+    del fb
+    with FrameBuffer(matrix_layout=[(0,0,0)]) as fb:
+        fb.start_dithering()
+    return not fb._dithering
+
+@testing.automatic
+def bad_backend():
+    try:
+        FrameBuffer(matrix_layout=[(0,0,0)], backend='bogus')
+    except ValueError:
+        return True
+    return False
+
 @testing.automatic
 def time_show():
     fb = FrameBuffer(matrix_layout=[(0,0,0)])
-    return timeit(partial(fb.show), loops=200) > 300
+    return timeit(partial(fb.show, force=True), loops=200) > 300
 
 #########################################################################
 # Sprite tests
@@ -618,6 +918,146 @@ def sprite_draw():
         '''
     return arrays_equal(expected_fb, fb)
 
+@testing.automatic
+def sprite_draw_clipped_transparent():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.erase(0xE)
+    s = Sprite('''
+        1 - 3
+        4 5 -
+        - 8 9
+        a b c
+        ''')
+    fb.draw(s, origin=(-1,6))
+    fb.draw(s, origin=(6,-2))
+    expected_fb = '''
+        89EEEEEE
+        BCEEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEE1E
+        EEEEEE45
+        '''
+    return arrays_equal(expected_fb, fb)
+
+@testing.automatic
+def sprite_draw_view():
+    s = Sprite('''
+        1 - 3
+        4 5 -
+        - 8 9
+        a b c
+        ''')
+    view = s.view().rotate(90).flip().crop((1,0),(3,2))
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.erase(0xE)
+    fb.draw(view, origin=(6,-1))
+    fb.draw(view.reset(), origin=(-1,3))
+    expected_fb = '''
+        EEEEEEEE
+        E3EEEEEE
+        5EEEEEEE
+        89EEEEEE
+        BCEEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEE85
+        '''
+    return arrays_equal(expected_fb, fb) and s.width == 3
+
+@testing.automatic
+def sprite_from_file_cache():
+    saved_cache_dir = led_matrix.SPRITE_CACHE_DIR
+    saved_cache_files = led_matrix.SPRITE_CACHE_FILES
+    with tempfile.TemporaryDirectory() as tmp:
+        led_matrix.SPRITE_CACHE_DIR = os.path.join(tmp, 'cache')
+        try:
+            sprite_file = os.path.join(tmp, 'sprite.spr')
+            with open(sprite_file, 'w') as f:
+                f.write(str(default_sprite))
+            first = Sprite.from_file(sprite_file)
+            cached = Sprite.from_file(sprite_file)
+            if len(os.listdir(led_matrix.SPRITE_CACHE_DIR)) != 1:
+                return False
+
+            # Modifying the sprite file invalidates the cached sprite
+            with open(sprite_file, 'w') as f:
+                f.write('1 - 3\n')
+            modified = Sprite.from_file(sprite_file)
+
+            # The oldest compiled sprite files are pruned
+            led_matrix.SPRITE_CACHE_FILES = 2
+            for i in range(4):
+                other_file = os.path.join(tmp, 'other{}.spr'.format(i))
+                with open(other_file, 'w') as f:
+                    f.write('1\n')
+                Sprite.from_file(other_file)
+            if len(os.listdir(led_matrix.SPRITE_CACHE_DIR)) != 2:
+                return False
+        finally:
+            led_matrix.SPRITE_CACHE_DIR = saved_cache_dir
+            led_matrix.SPRITE_CACHE_FILES = saved_cache_files
+    return (str(first) == str(cached) == str(default_sprite)
+        and cached.bitmap == default_sprite.bitmap and str(modified) == '1-3\n')
+
+@testing.automatic
+def str_out_of_range_colors():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.erase()
+    fb.point(1,1,200)
+    s = Sprite.from_array(memoryview(bytes([0x10, 0xFF, 3, 0xAB])).cast('B', (2, 2)))
+    return (str(fb).splitlines()[6] == '0C8' + '0' * 6
+        and str(s) == '-AB\n103\n')
+
+@testing.automatic
+def sprite_sheet_animation():
+    sheet = led_matrix.SpriteSheet(Sprite('''
+        1 1 2 2 3 3
+        1 1 2 2 3 3
+        4 4 5 5 - -
+        4 4 5 5 - -
+        '''), 2, 2, count=5)
+    if [str(frame) for frame in sheet] != [c*2 + '\n' + c*2 + '\n' for c in '12345']:
+        return False
+    animation = led_matrix.Animation(sheet, fps=10)
+    animation.start(100)
+    once = led_matrix.Animation(sheet, fps=10, loop=False)
+    once.start(100)
+    if not (animation.frame(100.25) is sheet[2] and animation.frame(100.55) is sheet[0]
+            and once.frame(101) is sheet[4] and once.done(101) and not once.done(100)):
+        return False
+    # Drawn at the current time
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    animation.start()
+    fb.draw(animation)
+    return fb._framebuffer()[0][:2] == [1, 1]
+
+@testing.automatic
+def blit_array():
+    fb = FrameBuffer(matrix_layout=[(0,0,0)])
+    fb.erase(0xE)
+    # Arrays are indexed [x, y]: 3 columns of 2 pixels, -1 transparent.
+    columns = [[1, 2], [3, -1], [5, 6]]
+    array = memoryview(bytes(color & 0xFF for column in columns for color in column)).cast('B', (3, 2))
+    mask = [[1, 1], [1, 1], [0, 1]]
+    fb.blit_array(array, origin=(6,-1), mask=mask)
+    fb.blit_array(columns, origin=(-1,6))
+    expected_fb = '''
+        E6EEEEEE
+        35EEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEEEE
+        EEEEEE2E
+        '''
+    sprite = Sprite.from_array(array, mask)
+    return (arrays_equal(expected_fb, fb) and sprite.bitmap == [[1, 2], [3, -1], [-1, 6]]
+        and fb.__array_interface__['shape'] == (8, 8))
+
 @testing.automatic
 def sprite_add():
     one = Sprite('''
@@ -730,6 +1170,24 @@ def sprite_rotate_and_crop():
         '''
     return arrays_equal(expected_bitmap, s)
 
+@testing.automatic
+def sprite_transform_cache():
+    s = copy.deepcopy(default_sprite)
+    rotated = s.rotate().bitmap
+    if s.rotate(-90).bitmap != s.original_bitmap:
+        return False
+    # Repeated transforms return the cached bitmap.
+    if s.rotate().bitmap is not rotated:
+        return False
+    s.reset().flip().flip(vertical=True)
+    expected_bitmap = '''
+        cba
+        987
+        654
+        321
+        '''
+    return arrays_equal(expected_bitmap, s) and s.rotate(180).bitmap == s.original_bitmap
+
 #########################################################################
 # Text tests
 #
@@ -748,6 +1206,47 @@ def text():
         '''
     return arrays_equal(expected_bitmap, t)
 
+@testing.automatic
+def text_font_name():
+    t = Text("Hi 2", char_spacing=2, font_name='3x5')
+    expected_bitmap = '''
+        F-F----------FFF
+        F-F--F---------F
+        FFF----------FFF
+        F-F--F-------F--
+        F-F--F-------FFF
+        '''
+    return arrays_equal(expected_bitmap, t) and Text.font_list() == ['3x5', '5x7']
+
+@testing.automatic
+def text_font_bundles():
+    # The font bundles must be rebuilt (make rstem-fonts) when fonts change.
+    font_dir = Text._font_dir()
+    for font_name in Text.font_list():
+        font_path = os.path.join(font_dir, font_name)
+        bundle = led_matrix._load_font_bundle(font_path + led_matrix.FONT_BUNDLE_EXT)
+        sprites = led_matrix._load_font_sprites(font_path)
+        if (bundle.height, bundle.space, bundle.unknown) != (sprites.height, sprites.space, sprites.unknown):
+            return False
+        if any(bundle.glyphs.get(char) != glyph for char, glyph in sprites.glyphs.items()):
+            return False
+    return True
+
+@testing.automatic
+def scrolling_text():
+    message = 'Hi, there!'
+    text = Text(message, font_name='3x5')
+    scroller = led_matrix.ScrollingText(iter(['Hi, ', 'there!']), 16, font_name='3x5')
+    for x in range(16, -text.width, -1):
+        fb = FrameBuffer(matrix_layout=[(0,0,0),(8,0,0)])
+        fb.draw(text, origin=(x,0))
+        scrolled_fb = FrameBuffer(matrix_layout=[(0,0,0),(8,0,0)])
+        scrolled_fb.draw(scroller)
+        if fb._framebuffer() != scrolled_fb._framebuffer():
+            return False
+        more = scroller.step()
+    return not more
+
 @testing.automatic
 def time_text():
     return timeit(partial(Text, '0123456789'), loops=10) > 5
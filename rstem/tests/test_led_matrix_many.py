@@ -6,6 +6,7 @@ vertically (i.e. clockwise rotated 90 degrees).  MISO should be hooked up.
 '''
 import testing_log
 import testing
+from rstem import led_matrix
 from rstem.led_matrix import FrameBuffer, Text
 import time
 
@@ -26,3 +27,12 @@ def char_on_each_matrix():
         fb.draw(chars[i], (2,8*i))
     fb.show()
 
+
+@testing.manual
+def tune_spi_speed():
+    '''The fastest SPI speed the chain can run at is found (and is at least
+    the default speed).  Requires MISO hooked up.
+    '''
+    speed = FrameBuffer.tune_spi_speed(save=False)
+    print('Fastest SPI speed: {} Hz'.format(speed))
+    return speed >= led_matrix.SPI_SPEED